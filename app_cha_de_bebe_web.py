@@ -1,25 +1,33 @@
 import streamlit as st
 import streamlit_authenticator as stauth
-import pandas as pd
 from datetime import datetime
 import database
+import painel_depuracao
+import perfil_rerun
 
 st.set_page_config(page_title="Organizador de Chá de Bebê", layout="wide")
 
+# Com ?profile=1 na URL, o rerun inteiro é medido (ver perfil_rerun.py)
+perfil = perfil_rerun.iniciar()
+# Cada rerun começa com a lista de operações do banco zerada
+database.start_rerun_metrics()
+
 def try_rerun():
     try:
         st.experimental_rerun()
     except AttributeError:
         st.stop()
 
+# Aviso de conexão instável no topo da página, preenchido no fim do rerun,
+# depois das leituras que podem ter encontrado a planilha fora do ar
+aviso_conexao = st.empty()
+
 try:
-    # Conecta planilha e busca usuários
+    # Conecta planilha; as credenciais são lidas só para o usuário que entra
     sheet = database.connect_to_sheet()
-    users_df = database.fetch_all_users(sheet)
-    users_dict = users_df.set_index('username').to_dict('index') if not users_df.empty else {}
 
     config = {
-        'credentials': {'usernames': users_dict},
+        'credentials': {'usernames': {}},
         'cookie': {'name': 'cha_de_bebe_cookie', 'key': 'uma_chave_secreta_qualquer', 'expiry_days': 30},
     }
 
@@ -29,6 +37,9 @@ try:
         config['cookie']['key'],
         config['cookie']['expiry_days']
     )
+    # O Authenticate copia o dict recebido; o mapeamento sob demanda entra depois
+    credenciais = database.UserCredentials(sheet)
+    authenticator.credentials['usernames'] = credenciais
 
     name, authentication_status, username = authenticator.login("Acessar Organizador", "main")
 
@@ -39,17 +50,10 @@ try:
         st.warning('Por favor, digite seu usuário e senha para entrar, ou registre-se abaixo.')
         try:
             if authenticator.register_user("Registrar Novo Usuário", preauthorization=False):
-                new_users_list = []
-                for uname, details in config['credentials']['usernames'].items():
-                    details['username'] = uname
-                    new_users_list.append(details)
-                new_users_df = pd.DataFrame(new_users_list)
-                if not new_users_df.empty:
-                    final_users_df = new_users_df[['username', 'email', 'name', 'password']]
-                    # Antes de salvar, preenche NaNs com vazio
-                    final_users_df = final_users_df.fillna("")
-                    database.update_users(sheet, final_users_df)
-                st.success('Usuário registrado com sucesso! Por favor, faça o login com suas novas credenciais.')
+                # Só a linha do novo usuário é anexada à planilha
+                for uname, details in credenciais.novos.items():
+                    if database.register_user(sheet, uname, details['email'], details['name'], details['password']):
+                        st.success('Usuário registrado com sucesso! Por favor, faça o login com suas novas credenciais.')
         except Exception as e:
             st.error(f"Erro no registro: {e}")
 
@@ -153,3 +157,11 @@ try:
 except Exception as e:
     st.error(f"Erro na inicialização do app: {e}")
     st.info("Verifique as credenciais e configuração do Google Sheets.")
+
+finally:
+    if database.is_degraded():
+        aviso_conexao.warning("⚠️ Sem conexão estável com a planilha: os dados podem estar desatualizados. "
+                              "As alterações serão gravadas assim que a conexão voltar.")
+    # Também depois de st.rerun()/st.stop() e de erros, para o perfil não ficar ligado
+    painel_depuracao.mostrar()
+    perfil_rerun.finalizar(perfil)
@@ -18,20 +18,25 @@ import streamlit_authenticator as stauth
 import pandas as pd
 from datetime import datetime
 import database 
+import painel_depuracao
+import perfil_rerun
 
 st.set_page_config(page_title="Organizador de Chá de Bebê", layout="wide")
 
+# Com ?profile=1 na URL, o rerun inteiro é medido (ver perfil_rerun.py)
+perfil = perfil_rerun.iniciar()
+# Cada rerun começa com a lista de operações do banco zerada
+database.start_rerun_metrics()
+
+# Aviso de conexão instável no topo da página, preenchido no fim do rerun,
+# depois das leituras que podem ter encontrado a planilha fora do ar
+aviso_conexao = st.empty()
+
 try:
     sheet = database.connect_to_sheet()
-    users_df = database.fetch_all_users(sheet)
-
-    if not users_df.empty:
-        users_dict = users_df.set_index('username').to_dict('index')
-    else:
-        users_dict = {}
 
     config = {
-        'credentials': {'usernames': users_dict},
+        'credentials': {'usernames': {}},
         'cookie': {'name': 'cha_de_bebe_cookie', 'key': 'uma_chave_secreta_qualquer', 'expiry_days': 30},
     }
 
@@ -41,6 +46,9 @@ try:
         config['cookie']['key'],
         config['cookie']['expiry_days']
     )
+    # O Authenticate copia o dict recebido; o mapeamento sob demanda entra depois
+    credenciais = database.UserCredentials(sheet)
+    authenticator.credentials['usernames'] = credenciais
 
     name, authentication_status, username = authenticator.login(fields={'Form name': 'Acessar Organizador', 'Username': 'Usuário', 'Password': 'Senha', 'Login': 'Entrar'})
 
@@ -57,8 +65,10 @@ try:
                                                    'Name':'Nome', 
                                                    'Password':'Senha'}, 
                                            pre_authorization=False):
-                
-                st.success('Usuário registrado com sucesso! Por favor, faça o login com suas novas credenciais.')
+                # Só a linha do novo usuário é anexada à planilha
+                for uname, details in credenciais.novos.items():
+                    if database.register_user(sheet, uname, details['email'], details['name'], details['password']):
+                        st.success('Usuário registrado com sucesso! Por favor, faça o login com suas novas credenciais.')
                 
         except Exception as e:
             st.error(e)
@@ -125,6 +135,11 @@ try:
             paginas = ["🗓️ Painel Principal", "👥 Convidados", "✅ Checklist", "💸 Gastos", "🎁 Presentes", "💡 Sugestões", "🎲 Brincadeiras", "⚙️ Configurações"]
             pagina = st.sidebar.radio("Ir para:", paginas)
 
+            # Ao sair de uma página, grava o que ainda estiver no buffer
+            if st.session_state.get('pagina_anterior') not in (None, pagina):
+                database.flush_pending_writes(sheet, username)
+            st.session_state['pagina_anterior'] = pagina
+
             # --- PÁGINAS DO APP ---
             nomes_bebes = evento_info.get('nome_bebe_1', '')
             if evento_info.get('e_gemeos') == "Sim" and evento_info.get('nome_bebe_2'):
@@ -135,17 +150,16 @@ try:
             if pagina == "🗓️ Painel Principal":
                 # ... (código da página do painel principal) ...
                 st.header("Seu Painel de Controle")
+                resumo = database.get_dashboard_summary(sheet, username)
                 col1, col2 = st.columns(2)
                 with col1:
-                    st.metric("Número de Convidados", len(database.get_convidados(sheet, username)))
+                    st.metric("Número de Convidados", resumo['convidados'])
                 with col2:
-                    tarefas, status = database.get_checklist(sheet, username)
-                    st.metric("Tarefas Pendentes", len(tarefas) - sum(status))
+                    st.metric("Tarefas Pendentes", resumo['tarefas_pendentes'])
                 st.divider()
                 st.subheader("💰 Resumo do Orçamento")
-                orcamento = database.get_orcamento(sheet, username)
-                gastos_df = database.get_gastos(sheet, username)
-                total_gasto = gastos_df['valor'].sum() if not gastos_df.empty else 0.0
+                orcamento = resumo['orcamento']
+                total_gasto = resumo['total_gasto']
                 c1, c2, c3 = st.columns(3)
                 c1.metric("Orçamento Total", f"R$ {orcamento:.2f}")
                 c2.metric("Total Gasto", f"R$ {total_gasto:.2f}")
@@ -161,7 +175,7 @@ try:
                 novo_convidado = st.text_input("Adicionar novo convidado:")
                 if st.button("Adicionar"):
                     if novo_convidado and novo_convidado not in convidados:
-                        database.set_convidados(sheet, username, convidados + [novo_convidado])
+                        database.add_convidado(sheet, username, novo_convidado)
                         st.success(f"'{novo_convidado}' adicionado à sua lista!")
                         st.rerun()
                     elif novo_convidado in convidados: st.warning("Este convidado já está na lista.")
@@ -182,27 +196,38 @@ try:
                     nova_tarefa_texto = st.text_input("Digite o nome da nova tarefa:", key="add_task_input")
                     if st.button("Adicionar Tarefa"):
                         if nova_tarefa_texto and nova_tarefa_texto not in tarefas:
-                            tarefas.append(nova_tarefa_texto)
-                            status.append(0)
-                            database.set_checklist(sheet, username, tarefas, status)
+                            database.add_tarefa(sheet, username, nova_tarefa_texto)
                             st.rerun()
                 st.divider()
+                aviso_salvando = st.empty()
                 for i, tarefa in enumerate(tarefas):
                     col1, col2 = st.columns([10, 1])
                     status_atual = bool(status[i])
                     if col1.checkbox(tarefa, value=status_atual, key=f"task_{i}") != status_atual:
+                        # O checkbox já mostra o novo estado; a gravação fica no buffer
                         status[i] = 1 if not status_atual else 0
-                        database.set_checklist(sheet, username, tarefas, status)
-                        st.rerun()
+                        database.queue_checklist(sheet, username, tarefas, status)
                     if col2.button("🗑️", key=f"del_task_{i}", help="Remover tarefa"):
                         tarefas.pop(i)
                         status.pop(i)
-                        database.set_checklist(sheet, username, tarefas, status)
+                        database.queue_checklist(sheet, username, tarefas, status)
                         st.rerun()
+                # A gravação termina numa thread, depois do rerun; o fragmento
+                # se atualiza sozinho enquanto houver algo pendente
+                @st.fragment(run_every=1 if database.has_pending_writes(sheet, username) else None)
+                def status_checklist():
+                    erro = database.pending_write_error(sheet, username)
+                    if erro:
+                        st.caption(f"⚠️ Não foi possível salvar o checklist ({erro}). Tentando de novo…")
+                    elif database.has_pending_writes(sheet, username):
+                        st.caption("💾 Salvando…")
+                with aviso_salvando:
+                    status_checklist()
             
             elif pagina == "💸 Gastos":
                 st.header("💸 Controle de Gastos")
-                orcamento_atual = database.get_orcamento(sheet, username)
+                # Orçamento e gastos numa leitura só; o get_gastos abaixo já sai do cache
+                orcamento_atual = database.load_user_bundle(sheet, username, ['orcamento', 'gastos']).orcamento
                 novo_orcamento = st.number_input("Defina seu orçamento total:", min_value=0.0, value=orcamento_atual, format="%.2f")
                 if novo_orcamento != orcamento_atual:
                     database.set_orcamento(sheet, username, novo_orcamento)
@@ -216,10 +241,7 @@ try:
                         submitted = st.form_submit_button("Adicionar Gasto")
                         if submitted:
                             if descricao and valor > 0:
-                                gastos_df = database.get_gastos(sheet, username)
-                                novo_gasto = pd.DataFrame([{'descricao': descricao, 'valor': valor, 'forma_pagamento': forma_pagamento}])
-                                df_atualizado = pd.concat([gastos_df, novo_gasto], ignore_index=True)
-                                database.set_gastos(sheet, username, df_atualizado)
+                                database.add_gasto(sheet, username, descricao, valor, forma_pagamento)
                                 st.success("Gasto adicionado!")
                             else:
                                 st.warning("Preencha a descrição e um valor maior que zero.")
@@ -227,7 +249,7 @@ try:
                 st.subheader("📊 Lista de Gastos")
                 gastos_df = database.get_gastos(sheet, username)
                 if not gastos_df.empty:
-                    st.dataframe(gastos_df, use_container_width=True)
+                    st.dataframe(gastos_df, use_container_width=True, hide_index=True, column_config={"id": None})
                     total_gasto = gastos_df['valor'].sum()
                     st.markdown(f"### **💰 Total gasto:** R$ {total_gasto:.2f}")
                 else:
@@ -242,10 +264,7 @@ try:
                         submitted = st.form_submit_button("Registrar Presente")
                         if submitted:
                             if convidado and presente:
-                                presentes_df = database.get_presentes(sheet, username)
-                                novo_presente = pd.DataFrame([{'convidado': convidado, 'presente': presente, 'agradecimento_enviado': 'Não'}])
-                                df_atualizado = pd.concat([presentes_df, novo_presente], ignore_index=True)
-                                database.set_presentes(sheet, username, df_atualizado)
+                                database.add_presente(sheet, username, convidado, presente)
                                 st.success("Presente registrado!")
                             else:
                                 st.warning("Por favor, preencha todos os campos.")
@@ -254,9 +273,10 @@ try:
                 presentes_df = database.get_presentes(sheet, username)
                 if not presentes_df.empty:
                     # Usando st.data_editor para uma edição mais interativa
-                    edited_df = st.data_editor(presentes_df, num_rows="dynamic", use_container_width=True, hide_index=True)
+                    edited_df = st.data_editor(presentes_df, num_rows="dynamic", use_container_width=True, hide_index=True,
+                                               column_config={"id": None})
                     if st.button("Salvar alterações nos presentes"):
-                        database.set_presentes(sheet, username, edited_df)
+                        database.save_collection_changes(sheet, username, 'presentes', presentes_df, edited_df)
                         st.success("Alterações salvas!")
                         st.rerun()
                 else:
@@ -273,10 +293,7 @@ try:
                         submitted = st.form_submit_button("Adicionar Sugestão")
                         if submitted:
                             if item:
-                                sugestoes_df = database.get_sugestoes(sheet, username)
-                                nova_sugestao = pd.DataFrame([{'item': item, 'detalhes': detalhes}])
-                                df_atualizado = pd.concat([sugestoes_df, nova_sugestao], ignore_index=True)
-                                database.set_sugestoes(sheet, username, df_atualizado)
+                                database.add_sugestao(sheet, username, item, detalhes)
                                 st.success("Sugestão adicionada!")
                             else:
                                 st.warning("O nome do item é obrigatório.")
@@ -284,7 +301,7 @@ try:
                 st.subheader("📋 Sua Lista de Sugestões")
                 sugestoes_df = database.get_sugestoes(sheet, username)
                 if not sugestoes_df.empty:
-                    st.dataframe(sugestoes_df, use_container_width=True, hide_index=True)
+                    st.dataframe(sugestoes_df, use_container_width=True, hide_index=True, column_config={"id": None})
                 else:
                     st.info("Nenhuma sugestão de presente adicionada ainda.")
 
@@ -299,10 +316,7 @@ try:
                         submitted = st.form_submit_button("Adicionar Brincadeira")
                         if submitted:
                             if nome:
-                                brincadeiras_df = database.get_brincadeiras(sheet, username)
-                                nova_brincadeira = pd.DataFrame([{'nome': nome, 'regras': regras}])
-                                df_atualizado = pd.concat([brincadeiras_df, nova_brincadeira], ignore_index=True)
-                                database.set_brincadeiras(sheet, username, df_atualizado)
+                                database.add_brincadeira(sheet, username, nome, regras)
                                 st.success("Brincadeira adicionada!")
                             else:
                                 st.warning("O nome da brincadeira é obrigatório.")
@@ -343,6 +357,14 @@ except Exception as e:
     st.error(f"Ocorreu um erro na conexão ou na inicialização do aplicativo: `{e}`")
     st.info("Verifique se as credenciais do Google Sheets estão configuradas corretamente no Streamlit Secrets e se o nome da planilha está correto.")
 
+finally:
+    if database.is_degraded():
+        aviso_conexao.warning("⚠️ Sem conexão estável com a planilha: os dados podem estar desatualizados. "
+                              "As alterações serão gravadas assim que a conexão voltar.")
+    # Também depois de st.rerun()/st.stop() e de erros, para o perfil não ficar ligado
+    painel_depuracao.mostrar()
+    perfil_rerun.finalizar(perfil)
+
 ```
 
 Depois de substituir e salvar o arquivo, por favor, pare seu servidor Streamlit (com `Ctrl+C` no terminal) e inicie-o novamente (`streamlit run app_cha_de_bebe_web.py`). Isso garante que ele lerá a nova versão do arquivo do zero.
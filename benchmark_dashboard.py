@@ -0,0 +1,57 @@
+"""Compara as chamadas à API do Painel Principal: get_* separados x resumo único.
+
+Uso: python benchmark_dashboard.py
+"""
+import database
+from fake_sheets import FakeWorksheet
+
+
+def montar_planilha(n_usuarios):
+    header = ['username', 'email', 'name', 'password', 'convidados',
+              'checklist_tarefas', 'checklist_status', 'orcamento']
+    linhas = [
+        [f'user{i}', f'user{i}@x.com', f'User {i}', 'hash', 'Ana,Bia,Carla',
+         'Bolo;Convites;Decoração', '1;0;0', 500.0]
+        for i in range(n_usuarios)
+    ]
+    ws = FakeWorksheet([header] + linhas)
+    gastos = [['username', 'id', 'descricao', 'valor', 'forma_pagamento']] + [
+        [f'user{i}', f'{i}-{j}', f'item {j}', 10.0, 'PIX']
+        for i in range(n_usuarios) for j in range(5)
+    ]
+    FakeWorksheet(gastos, spreadsheet=ws.spreadsheet, title='gastos')
+    return ws
+
+
+def painel_antigo(ws, username):
+    database.get_convidados(ws, username)
+    database.get_checklist(ws, username)
+    database.get_orcamento(ws, username)
+    database.get_gastos(ws, username)
+
+
+def painel_novo(ws, username):
+    database.get_dashboard_summary(ws, username)
+
+
+def medir(funcao, n_usuarios):
+    ws = montar_planilha(n_usuarios)
+    # Índices e data de modificação já conhecidos, como num app em uso
+    database._geracao(ws.spreadsheet)
+    database._get_index(ws)
+    database._get_tab_index(database._get_aba(ws, 'gastos'))
+    ws.calls.clear()
+    funcao(ws, f'user{n_usuarios // 2}')
+    return sum(ws.calls.values())
+
+
+def main():
+    print(f"{'usuários':>9} {'get_* separados':>16} {'resumo único':>13}")
+    for n in (10, 1000, 10000):
+        antigo = medir(painel_antigo, n)
+        novo = medir(painel_novo, n)
+        print(f"{n:>9} {antigo:>10} chamadas {novo:>5} chamada(s)")
+
+
+if __name__ == '__main__':
+    main()
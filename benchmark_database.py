@@ -0,0 +1,171 @@
+"""Chamadas à API, bytes e tempo de cada função do database.py.
+
+Roda cada get_*/set_*/add_* contra a planilha em memória do fake_sheets.py
+com 10, 1.000 e 10.000 usuários e imprime uma tabela; rodar antes e depois
+de mexer no database.py mostra regressões nos caminhos mais usados.
+
+Cada medição começa com os índices e a data de modificação já conhecidos,
+como num app em uso, mas sem nada do usuário em cache (primeira leitura
+da sessão).
+
+O limitador local de chamadas (SHEETS_QUOTA_PER_MINUTE) fica desligado,
+senão o tempo medido seria o da espera por ele; --limite-local o liga.
+
+Uso: python benchmark_database.py [--usuarios 10 1000] [--latencia 0.05]
+                                  [--cota 300] [--limite-local 60]
+                                  [--repeticoes 3] [--filtro gastos]
+"""
+import argparse
+import statistics
+import time
+
+import database
+from fake_sheets import FakeWorksheet
+
+CABECALHO = database.USER_COLUMNS + [
+    'nome_bebe', 'sexo_bebe', 'data_cha', 'convidados',
+    'checklist_tarefas', 'checklist_status', 'orcamento']
+
+ITENS_POR_USUARIO = 5
+
+
+def montar_planilha(n_usuarios, **opcoes):
+    linhas = [
+        [f'user{i}', f'user{i}@x.com', f'User {i}', 'hash', 'Maria', 'Menina', '2025-01-01',
+         'Ana,Bia,Carla', 'Bolo;Convites;Decoração', '1;0;0', 500.0]
+        for i in range(n_usuarios)
+    ]
+    ws = FakeWorksheet([CABECALHO] + linhas, **opcoes)
+    exemplos = {
+        'gastos': ['item', 10.0, 'PIX'],
+        'presentes': ['Ana', 'Fraldas', 'Não'],
+        'sugestoes': ['Fraldas', 'Tamanho P'],
+        'brincadeiras': ['Bingo', 'Cartelas'],
+    }
+    for colecao, colunas in database.COLLECTION_COLUMNS.items():
+        valores = [['username', 'id'] + colunas] + [
+            [f'user{i}', f'{i}-{j}'] + exemplos[colecao]
+            for i in range(n_usuarios) for j in range(ITENS_POR_USUARIO)
+        ]
+        FakeWorksheet(valores, spreadsheet=ws.spreadsheet, title=colecao)
+    return ws
+
+
+def _presentes_editados(ws, username):
+    original = database.get_presentes(ws, username)
+    editado = original.copy()
+    if not editado.empty:
+        editado.loc[editado.index[0], 'agradecimento_enviado'] = 'Sim'
+    return original, editado
+
+
+# (nome, preparo, medição): o preparo roda fora da medição e o que ele
+# devolve é passado para a medição depois de (ws, username)
+CASOS = [
+    ('fetch_all_users', None, lambda ws, u: database.fetch_all_users(ws)),
+    ('get_user_credentials', None, lambda ws, u: database.get_user_credentials(ws, u)),
+    ('register_user', None, lambda ws, u: database.register_user(ws, f'novo_{u}_{time.monotonic_ns()}', 'n@x.com', 'Novo', 'hash')),
+    ('get_evento_atual', None, lambda ws, u: database.get_evento_atual(ws, u)),
+    ('set_evento_atual', None, lambda ws, u: database.set_evento_atual(
+        ws, u, {'nome_bebe': 'Júlia', 'sexo_bebe': 'Menina', 'data_cha': '2025-02-02'})),
+    ('get_convidados', None, lambda ws, u: database.get_convidados(ws, u)),
+    ('set_convidados', None, lambda ws, u: database.set_convidados(ws, u, ['Ana', 'Bia', 'Carla', 'Duda'])),
+    ('add_convidado', None, lambda ws, u: database.add_convidado(ws, u, 'Eva')),
+    ('get_checklist', None, lambda ws, u: database.get_checklist(ws, u)),
+    ('set_checklist', None, lambda ws, u: database.set_checklist(ws, u, ['Bolo', 'Convites'], [1, 1])),
+    ('add_tarefa', None, lambda ws, u: database.add_tarefa(ws, u, 'Lembrancinhas')),
+    ('get_orcamento', None, lambda ws, u: database.get_orcamento(ws, u)),
+    ('set_orcamento', None, lambda ws, u: database.set_orcamento(ws, u, 750.0)),
+    ('get_gastos', None, lambda ws, u: database.get_gastos(ws, u)),
+    ('set_gastos', lambda ws, u: database.get_gastos(ws, u), lambda ws, u, df: database.set_gastos(ws, u, df)),
+    ('add_gasto', None, lambda ws, u: database.add_gasto(ws, u, 'Balões', 25.0, 'PIX')),
+    ('get_presentes', None, lambda ws, u: database.get_presentes(ws, u)),
+    ('set_presentes', lambda ws, u: database.get_presentes(ws, u), lambda ws, u, df: database.set_presentes(ws, u, df)),
+    ('save_collection_changes', _presentes_editados,
+     lambda ws, u, original, editado: database.save_collection_changes(ws, u, 'presentes', original, editado)),
+    ('add_presente', None, lambda ws, u: database.add_presente(ws, u, 'Bia', 'Body')),
+    ('get_sugestoes', None, lambda ws, u: database.get_sugestoes(ws, u)),
+    ('set_sugestoes', lambda ws, u: database.get_sugestoes(ws, u), lambda ws, u, df: database.set_sugestoes(ws, u, df)),
+    ('add_sugestao', None, lambda ws, u: database.add_sugestao(ws, u, 'Lenços')),
+    ('get_brincadeiras', None, lambda ws, u: database.get_brincadeiras(ws, u)),
+    ('set_brincadeiras', lambda ws, u: database.get_brincadeiras(ws, u),
+     lambda ws, u, df: database.set_brincadeiras(ws, u, df)),
+    ('add_brincadeira', None, lambda ws, u: database.add_brincadeira(ws, u, 'Mímica')),
+    ('get_dashboard_summary', None, lambda ws, u: database.get_dashboard_summary(ws, u)),
+    ('load_user_bundle', None, lambda ws, u: database.load_user_bundle(ws, u)),
+]
+
+
+def _esvaziar_caches_do_usuario():
+    # Mantém índices e abas (valem para o app inteiro), descarta os dados lidos
+    with database._snapshots_lock:
+        database._snapshots.clear()
+        database._cells.clear()
+        database._itens.clear()
+
+
+def _aquecer(ws):
+    database._geracao(ws.spreadsheet, consultar=True)
+    database._get_index(ws)
+    for colecao in database.COLLECTION_COLUMNS:
+        database._get_tab_index(database._get_aba(ws, colecao))
+
+
+def medir(ws, preparo, funcao, username):
+    _aquecer(ws)
+    _esvaziar_caches_do_usuario()
+    extras = preparo(ws, username) if preparo else ()
+    if not isinstance(extras, tuple):
+        extras = (extras,)
+    ws.calls.clear()
+    ws.bytes.clear()
+    inicio = time.perf_counter()
+    funcao(ws, username, *extras)
+    decorrido = time.perf_counter() - inicio
+    recusadas = ws.calls.pop('429', 0)
+    return sum(ws.calls.values()), recusadas, ws.bytes['enviados'] + ws.bytes['recebidos'], decorrido
+
+
+def _formatar_bytes(n):
+    for unidade in ('B', 'KB', 'MB'):
+        if n < 1024:
+            return f"{n:.0f} {unidade}"
+        n /= 1024
+    return f"{n:.1f} GB"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--usuarios', type=int, nargs='+', default=[10, 1000, 10000])
+    parser.add_argument('--latencia', type=float, default=0.0, help="segundos por chamada à API")
+    parser.add_argument('--cota', type=int, default=None, help="chamadas por minuto antes do erro 429")
+    parser.add_argument('--limite-local', type=int, default=0,
+                        help="chamadas por minuto do limitador do database.py (0 = desligado)")
+    parser.add_argument('--repeticoes', type=int, default=3)
+    parser.add_argument('--filtro', default='', help="só as funções com este trecho no nome")
+    args = parser.parse_args()
+
+    database._bucket = database._TokenBucket(args.limite_local)
+    casos = [caso for caso in CASOS if args.filtro in caso[0]]
+    for n in args.usuarios:
+        print(f"\n{n} usuários")
+        print(f"{'função':<24} {'chamadas':>8} {'429':>4} {'bytes':>10} {'tempo (ms)':>11}")
+        ws = montar_planilha(n, latencia=args.latencia, cota_por_minuto=args.cota)
+        for i, (nome, preparo, funcao) in enumerate(casos):
+            tempos = []
+            try:
+                for r in range(args.repeticoes):
+                    # Um usuário diferente por medição, espalhado pela planilha
+                    username = f'user{(i * args.repeticoes + r) * 7919 % n}'
+                    chamadas, recusadas, transferidos, decorrido = medir(ws, preparo, funcao, username)
+                    tempos.append(decorrido)
+            except Exception as e:
+                # Com --cota baixa o preparo também pode esgotar as tentativas
+                print(f"{nome:<24} falhou: {e}")
+                continue
+            print(f"{nome:<24} {chamadas:>8} {recusadas:>4} {_formatar_bytes(transferidos):>10} "
+                  f"{statistics.median(tempos) * 1000:>11.1f}")
+
+
+if __name__ == '__main__':
+    main()
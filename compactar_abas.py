@@ -0,0 +1,21 @@
+import database
+
+
+def compactar_abas():
+    sheet = database.connect_to_sheet(offline=False)
+    if sheet is None:
+        print("Não foi possível conectar à planilha.")
+        return
+
+    # Itens apagados ficam como linhas com o username em branco; removê-las
+    # desloca as linhas seguintes, então o app precisa estar parado.
+    resposta = input("O app está parado (nenhuma sessão aberta)? [s/N] ")
+    if resposta.strip().lower() != "s":
+        print("Compactação cancelada.")
+        return
+    removidas = database.compact_collections(sheet)
+    print(f"Compactação concluída: {removidas} linha(s) de itens apagados removida(s).")
+
+
+if __name__ == "__main__":
+    compactar_abas()
@@ -1,487 +1,3267 @@
+import abc
+import atexit
+import contextlib
+import functools
+import hashlib
+import http.server
+import inspect
+import io
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict, namedtuple
+from collections.abc import MutableMapping
+from concurrent.futures import ThreadPoolExecutor, wait
+
 import gspread
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import requests
+from google.auth.exceptions import RefreshError, TransportError
+from google.auth.transport.requests import AuthorizedSession
 from google.oauth2.service_account import Credentials
 import streamlit as st
+import tenacity
+from cachetools import LRUCache
+
+# Nome da planilha no Google Sheets
+SHEET_NAME = 'ChaDeBebe_DB'
+
+# Arquivo usado quando o backend configurado é o SQLite
+SQLITE_PATH = 'cha_de_bebe.db'
+
+# Colunas de credenciais; o restante da linha são os dados do evento
+USER_COLUMNS = ['username', 'email', 'name', 'password']
+
+# Coleções do evento, com as colunas de cada DataFrame. Cada uma fica numa
+# aba própria (uma linha por item: username, id e estas colunas).
+COLLECTION_COLUMNS = {
+    'gastos': ['descricao', 'valor', 'forma_pagamento'],
+    'presentes': ['convidado', 'presente', 'agradecimento_enviado'],
+    'sugestoes': ['item', 'detalhes'],
+    'brincadeiras': ['nome', 'regras'],
+}
+
+# Por quanto tempo (em segundos) uma leitura completa da planilha é
+# reaproveitada pelos get_*. Dentro desse intervalo, um rerun do Streamlit
+# faz no máximo uma leitura, em vez de uma por função chamada.
+SNAPSHOT_TTL = 15
+
+# Depois do SNAPSHOT_TTL, o cache não é descartado: antes ele é conferido
+# com a data de modificação da planilha no Drive, consultada no máximo uma
+# vez a cada REVISION_TTL segundos por processo. Se nada mudou, os dados em
+# memória continuam valendo, até CACHE_MAX_AGE segundos desde a leitura.
+REVISION_TTL = 5
+CACHE_MAX_AGE = 600
+
+# Quantas entradas (usuário x aba) os caches de células e itens guardam; as
+# menos usadas recentemente saem primeiro.
+CACHE_MAX_ENTRIES = 2000
+
+# O índice username -> linha vale enquanto a planilha está na geração em
+# que ele foi lido (ordenar ou apagar linhas muda a data de modificação);
+# INDEX_TTL é só um limite a mais, já que os anexos ele mesmo registra.
+INDEX_TTL = 300
+
+# Cota da API do Sheets por usuário (a conta de serviço conta como um só
+# usuário para todas as sessões). Pode ser ajustada com quota_per_minute em
+# [database] nos secrets; 0 desliga o limitador.
+SHEETS_QUOTA_PER_MINUTE = 60
+
+# Tentativas para erros 429 (cota estourada) e 5xx antes de desistir
+API_MAX_TENTATIVAS = 5
+
+# Espera (em segundos) após o último clique no checklist antes de gravar
+CHECKLIST_DEBOUNCE = 2.0
+
+# Espera máxima (em segundos) entre novas tentativas de gravar o checklist
+CHECKLIST_RETRY_MAX = 60.0
+
+# Circuit breaker: depois de CIRCUIT_FALHAS chamadas seguidas falhando por
+# cota ou indisponibilidade, a API não é chamada por CIRCUIT_ESPERA segundos
+# e o app passa a servir os últimos dados bons.
+CIRCUIT_FALHAS = 3
+CIRCUIT_ESPERA = 30
+
+# Cópia local da aba principal em Parquet. Na partida do processo ela é
+# servida na hora (a tela de login não espera o Google) enquanto a planilha
+# abre e é lida em segundo plano; também é usada se a planilha não abrir.
+OFFLINE_SNAPSHOT_PATH = os.path.join('.cache', 'planilha.parquet')
+
+# De quantos em quantos segundos a thread da cópia local confere se a planilha
+# mudou; só quando mudou ela lê a aba inteira e regrava o arquivo
+OFFLINE_SNAPSHOT_INTERVAL = 300
+
+# Quanto uma leitura por usuário espera a planilha abrir em segundo plano
+# antes de usar só a cópia local
+CONNECT_TIMEOUT = 15
+
+# Métricas de cada operação (ver _medido). Com metrics = "prometheus" em
+# [database] nos secrets (ou CHA_METRICS no ambiente), os contadores ficam
+# em http://METRICS_HOST:METRICS_PORT/metrics; com "json", cada operação vira uma
+# linha JSON no log "database.metricas". Os dois podem ser combinados.
+METRICS_PORT = 9464
+
+# Endereço do endpoint /metrics, que não tem autenticação: por padrão só a
+# própria máquina; metrics_host (ou CHA_METRICS_HOST) abre para a rede
+METRICS_HOST = '127.0.0.1'
+
+# Threads que preparam em paralelo as abas e os índices ainda não lidos
+# (ver load_user_bundle); também limita essas chamadas simultâneas à API
+PREFETCH_WORKERS = 4
+
+_snapshots = LRUCache(maxsize=16)
+_indices = {}
+_cells = LRUCache(maxsize=CACHE_MAX_ENTRIES)
+_abas = {}
+_tab_indices = {}
+_itens = LRUCache(maxsize=CACHE_MAX_ENTRIES)
+_snapshots_lock = threading.Lock()
+
+# Por planilha: a última data de modificação vista no Drive e a "geração"
+# correspondente. Entradas de cache lidas numa geração valem enquanto ela
+# não muda.
+_revisoes = {}
+_revisoes_lock = threading.Lock()
+
+# Métodos do gspread que alteram a planilha (ver _api)
+_METODOS_ESCRITA = {'update', 'batch_update', 'values_batch_update', 'append_row', 'append_rows', 'clear', 'add_worksheet'}
+
+# Escritas que, repetidas, gravam de novo: só são refeitas quando a API
+# certamente não as executou (429, ou falha de auth antes do envio)
+_METODOS_ANEXO = {'append_row', 'append_rows'}
+
+# Métodos de leitura que podem ser compartilhados entre sessões (ver _SingleFlight)
+_METODOS_LEITURA = {'get_all_values', 'get_all_records', 'get', 'batch_get', 'values_batch_get',
+                    'get_lastUpdateTime', 'worksheet'}
+
+
+def _geracao(spreadsheet, consultar=False):
+    """Geração atual da planilha; com `consultar`, confere a data no Drive.
+
+    Sem nenhuma data conhecida a consulta é sempre feita; nas demais vezes,
+    só se a última tiver mais de REVISION_TTL segundos, então muitas sessões
+    validando o cache ao mesmo tempo fazem uma chamada só.
+    """
+    with _revisoes_lock:
+        revisao = _revisoes.get(spreadsheet.id)
+        if revisao is not None and (not consultar or time.monotonic() - revisao['verificado_em'] <= REVISION_TTL):
+            return revisao['geracao']
+    try:
+        valor = _api(spreadsheet, 'get_lastUpdateTime')
+    except Exception:
+        return None
+    with _revisoes_lock:
+        revisao = _revisoes.setdefault(spreadsheet.id, {'valor': valor, 'geracao': 0})
+        if revisao['valor'] != valor:
+            # Toda mudança conta, inclusive as deste processo: a data do Drive
+            # não diz se outra sessão também gravou no mesmo intervalo.
+            revisao['geracao'] += 1
+        revisao['valor'] = valor
+        revisao['verificado_em'] = time.monotonic()
+        return revisao['geracao']
+
+
+class _Entrada:
+    """Valor guardado nos caches por usuário, com a geração em que foi lido."""
+
+    def __init__(self, geracao, valor):
+        self.geracao = geracao
+        self.valor = valor
+        self.criado_em = self.validado_em = time.monotonic()
+
+
+def _valido(spreadsheet, entrada):
+    """True se a entrada ainda pode ser usada, conferindo o Drive se preciso."""
+    agora = time.monotonic()
+    if agora - entrada.validado_em <= SNAPSHOT_TTL:
+        return True
+    if entrada.geracao is None or agora - entrada.criado_em > CACHE_MAX_AGE:
+        return False
+    if _geracao(spreadsheet, consultar=True) != entrada.geracao:
+        return False
+    entrada.validado_em = agora
+    return True
+
+
+class _Snapshot:
+    """Cópia em memória da planilha, indexada por username."""
+
+    def __init__(self, valores, geracao=None):
+        self.header = list(valores[0]) if valores else []
+        self.records = [dict(zip(self.header, linha)) for linha in valores[1:]]
+        self.linhas = {}
+        for i, record in enumerate(self.records):
+            nome = str(record.get('username', ''))
+            if nome:
+                self.linhas.setdefault(nome, i)
+        self.geracao = geracao
+        self.criado_em = self.validado_em = time.monotonic()
+
+    def user_row(self, username):
+        i = self.linhas.get(str(username))
+        return None if i is None else self.records[i]
+
+
+def _snapshot_key(worksheet):
+    return (worksheet.spreadsheet.id, worksheet.id)
+
+
+def _get_snapshot(worksheet):
+    chave = _snapshot_key(worksheet)
+    with _snapshots_lock:
+        snapshot = _snapshots.get(chave)
+    if snapshot is None and worksheet is _connection.current():
+        # Partida: a cópia local responde já e a leitura vai para segundo plano
+        snapshot = _ler_snapshot_local()
+        if snapshot is not None:
+            with _snapshots_lock:
+                _snapshots.setdefault(chave, snapshot)
+            threading.Thread(target=_atualizar_snapshot, args=(worksheet,), daemon=True).start()
+            return snapshot
+    valido = snapshot is not None and _valido(worksheet.spreadsheet, snapshot)
+    _contar_cache(valido)
+    if not valido:
+        try:
+            snapshot = _buscar_snapshot(worksheet)
+        except Exception as e:
+            # Planilha fora do ar: o último snapshot bom, mesmo vencido
+            antigo = snapshot
+            if antigo is None and worksheet is _connection.current():
+                antigo = _ler_snapshot_local()
+            if antigo is None or not _indisponivel(e):
+                raise
+            _marcar_degradado()
+            return antigo
+    return snapshot
+
+
+def _buscar_snapshot(worksheet):
+    geracao = _geracao(worksheet.spreadsheet)
+    valores = _api(worksheet, 'get_all_values')
+    snapshot = _Snapshot(valores, geracao)
+    # A leitura completa já traz tudo o que o índice precisa
+    index = _SheetIndex(snapshot.header, [[r.get('username', '')] for r in snapshot.records], geracao)
+    chave = _snapshot_key(worksheet)
+    with _snapshots_lock:
+        _snapshots[chave] = snapshot
+        _indices[chave] = index
+    if worksheet is _connection.current():
+        _agendar_copia_local(valores)
+    return snapshot
+
+
+def _atualizar_snapshot(worksheet):
+    try:
+        _buscar_snapshot(worksheet)
+    except Exception:
+        # Segue com a cópia local; a próxima leitura tenta de novo
+        pass
+
+
+# Gravação da cópia local em segundo plano (ver _agendar_copia_local)
+_copia_local = {'pendente': None, 'gravando': False, 'resumo': None, 'thread': None}
+_copia_local_lock = threading.Lock()
+
+
+def _agendar_copia_local(valores):
+    # A leitura não espera o Parquet: uma thread grava a versão mais recente,
+    # e leituras feitas enquanto ela grava viram uma gravação só
+    with _copia_local_lock:
+        _copia_local['pendente'] = valores
+        if _copia_local['gravando']:
+            return
+        _copia_local['gravando'] = True
+    threading.Thread(target=_gravar_copia_local, daemon=True).start()
+
+
+def _gravar_copia_local():
+    while True:
+        with _copia_local_lock:
+            valores, _copia_local['pendente'] = _copia_local['pendente'], None
+            if valores is None:
+                _copia_local['gravando'] = False
+                return
+        # Só regrava o arquivo se a planilha mudou desde a última cópia
+        resumo = hashlib.sha1(json.dumps(valores, default=str).encode()).hexdigest()
+        if resumo != _copia_local['resumo']:
+            _salvar_snapshot_local(valores)
+            _copia_local['resumo'] = resumo
+
+
+def _iniciar_copia_local():
+    # Uma thread por processo mantém a cópia local em dia, sem depender de
+    # alguma página ler a aba inteira
+    with _copia_local_lock:
+        if _copia_local.get('thread') is not None:
+            return
+        _copia_local['thread'] = threading.Thread(target=_manter_copia_local, daemon=True)
+    _copia_local['thread'].start()
+
+
+def _manter_copia_local():
+    copiada = None
+    while True:
+        try:
+            worksheet = _connection.current()
+            if worksheet is not None:
+                geracao = _geracao(worksheet.spreadsheet, consultar=True)
+                if geracao is None or geracao != copiada:
+                    _buscar_snapshot(worksheet)
+                    copiada = geracao
+        except Exception:
+            # Planilha fora do ar ou sem cota: tenta de novo na próxima volta
+            pass
+        time.sleep(OFFLINE_SNAPSHOT_INTERVAL)
+
+
+def _salvar_snapshot_local(valores):
+    # Todas as colunas como texto, com o cabeçalho na primeira linha: nomes
+    # de coluna vazios ou repetidos na planilha não atrapalham o Parquet
+    largura = max((len(linha) for linha in valores), default=0)
+    colunas = [[] for _ in range(largura)]
+    for linha in valores:
+        for i in range(largura):
+            colunas[i].append(str(linha[i]) if i < len(linha) else "")
+    tabela = pa.table({f"c{i}": pa.array(coluna, pa.string()) for i, coluna in enumerate(colunas)})
+    try:
+        os.makedirs(os.path.dirname(OFFLINE_SNAPSHOT_PATH) or '.', exist_ok=True)
+        temporario = OFFLINE_SNAPSHOT_PATH + '.tmp'
+        pq.write_table(tabela, temporario)
+        os.replace(temporario, OFFLINE_SNAPSHOT_PATH)
+    except OSError:
+        pass
+
+
+def _ler_snapshot_local():
+    try:
+        tabela = pq.read_table(OFFLINE_SNAPSHOT_PATH, memory_map=True)
+    except (OSError, pa.ArrowException):
+        return None
+    colunas = [tabela.column(i).to_pylist() for i in range(tabela.num_columns)]
+    return _Snapshot([list(linha) for linha in zip(*colunas)])
+
+
+class _SheetIndex:
+    """Linha de cada username e coluna de cada campo na planilha."""
+
+    def __init__(self, header, usernames, geracao=None):
+        # `usernames` vem como lista de linhas de uma coluna ([['ana'], ['bia'], []])
+        self.geracao = geracao
+        self.header = list(header)
+        self.colunas = {col: i + 1 for i, col in enumerate(self.header) if col}
+        self.linhas = {}
+        self.minusculas = {}
+        for i, linha in enumerate(usernames):
+            nome = str(linha[0]) if linha else ''
+            if nome:
+                self.linhas.setdefault(nome, i + 2)
+                self.minusculas.setdefault(nome.lower(), nome)
+        self.criado_em = time.monotonic()
+
+    def expirado(self):
+        return time.monotonic() - self.criado_em > INDEX_TTL
+
+    def row(self, username):
+        return self.linhas.get(str(username))
+
+    def column_letter(self, col):
+        return gspread.utils.rowcol_to_a1(1, self.colunas[col])[:-1]
+
+    def a1(self, row, col):
+        return gspread.utils.rowcol_to_a1(row, self.colunas[col])
+
+    def add_column(self, col):
+        self.header.append(col)
+        self.colunas[col] = len(self.header)
+
+    def find(self, username):
+        """Username como está na planilha, sem diferenciar maiúsculas."""
+        nome = str(username)
+        return nome if nome in self.linhas else self.minusculas.get(nome.lower())
+
+    def add_row(self, username, row):
+        self.linhas.setdefault(str(username), row)
+        self.minusculas.setdefault(str(username).lower(), str(username))
+
+
+def _get_index(worksheet, refresh=False, conferir=False):
+    """Índice da planilha, montado com uma leitura do cabeçalho e dos usernames.
+
+    É relido quando a geração da planilha muda, já que linhas podem ter sido
+    ordenadas ou apagadas. Com `conferir` (antes de gravar), a data de
+    modificação é consultada se a última consulta tiver mais de REVISION_TTL
+    segundos.
+    """
+    chave = _snapshot_key(worksheet)
+    geracao = _geracao(worksheet.spreadsheet, consultar=conferir)
+    with _snapshots_lock:
+        index = _indices.get(chave)
+    if index is None or index.expirado() or refresh or index.geracao != geracao:
+        header, usernames = _api(worksheet, 'batch_get', ['1:1', 'A2:A'])
+        header = header[0] if header else []
+        if header and header[0] != 'username' and 'username' in header:
+            # Planilha antiga com username fora da coluna A
+            letra = gspread.utils.rowcol_to_a1(1, header.index('username') + 1)[:-1]
+            usernames = _api(worksheet, 'get', f'{letra}2:{letra}')
+        index = _SheetIndex(header, usernames, geracao)
+        with _snapshots_lock:
+            _indices[chave] = index
+    return index
+
+
+# Colunas que guardam uma lista numa célula, com o separador de cada uma
+LIST_SEPARATORS = {
+    'convidados': ',',
+    'checklist_tarefas': ';',
+    'checklist_status': ';',
+}
+
+
+def _parse_lista(col, tipo=str):
+    sep = LIST_SEPARATORS[col]
+    return lambda valor: [tipo(v) for v in str(valor).split(sep)] if valor != "" else []
+
+
+def _parse_colecao(col):
+    def parse(valor):
+        if not valor:
+            return pd.DataFrame(columns=COLLECTION_COLUMNS[col])
+        return pd.read_json(io.StringIO(valor))
+    return parse
+
+
+# Conversão do valor bruto da célula para o tipo usado pelo app
+_COLUMN_PARSERS = {
+    'convidados': _parse_lista('convidados'),
+    'checklist_tarefas': _parse_lista('checklist_tarefas'),
+    'checklist_status': _parse_lista('checklist_status', int),
+    'orcamento': lambda valor: float(valor) if valor != "" else 0.0,
+    **{col: _parse_colecao(col) for col in COLLECTION_COLUMNS},
+}
+
+
+def _parse(col, valor):
+    if valor is None:
+        valor = ""
+    parser = _COLUMN_PARSERS.get(col)
+    return parser(valor) if parser else valor
+
+
+def _peek_user_row(worksheet, username):
+    # Linha do usuário num snapshot completo ainda válido, sem ir à planilha
+    with _snapshots_lock:
+        snapshot = _snapshots.get(_snapshot_key(worksheet))
+    if snapshot is None or not _valido(worksheet.spreadsheet, snapshot):
+        return None
+    return snapshot.user_row(username)
+
+
+def _get_aba(worksheet, colecao):
+    """Aba da coleção na mesma planilha, criada com o cabeçalho se não existir."""
+    spreadsheet = worksheet.spreadsheet
+    chave = (spreadsheet.id, colecao)
+    with _snapshots_lock:
+        aba = _abas.get(chave)
+    if aba is None:
+        try:
+            aba = _api(spreadsheet, 'worksheet', colecao)
+        except gspread.exceptions.WorksheetNotFound:
+            header = ['username', 'id'] + COLLECTION_COLUMNS[colecao]
+            aba = _api(spreadsheet, 'add_worksheet', colecao, rows=1000, cols=len(header))
+            _api(aba, 'update', 'A1', [header])
+        with _snapshots_lock:
+            _abas[chave] = aba
+    return aba
+
+
+class _TabIndex:
+    """Linhas de cada usuário numa aba de coleção (username na coluna A, id na B).
+
+    Linhas com o username em branco são itens apagados (ver
+    _delete_sheet_items) e não pertencem a ninguém.
+    """
+
+    def __init__(self, header, linhas, geracao=None):
+        self.geracao = geracao
+        self.header = list(header)
+        self.entradas = [[str(v) for v in (list(linha) + ["", ""])[:2]] for linha in linhas]
+        self.criado_em = time.monotonic()
+
+    def expirado(self):
+        return time.monotonic() - self.criado_em > INDEX_TTL
+
+    def user_rows(self, username):
+        nome = str(username)
+        return [(i + 2, id_) for i, (u, id_) in enumerate(self.entradas) if u and u == nome]
+
+    def add_rows(self, primeira, entradas):
+        """Registra linhas anexadas; False se antes delas há linhas desconhecidas."""
+        if primeira - 2 > len(self.entradas):
+            # Outro processo anexou linhas que este índice não conhece
+            return False
+        self.entradas[primeira - 2:primeira - 2 + len(entradas)] = entradas
+        return True
+
+    def tombstone_rows(self, linhas):
+        for linha in linhas:
+            self.entradas[linha - 2][0] = ""
+
+
+def _get_tab_index(aba, refresh=False, qualquer_geracao=False):
+    """Índice da aba de coleção, relido quando a geração da planilha muda.
+
+    Com `qualquer_geracao`, serve o índice em memória mesmo de uma geração
+    anterior: para quem confere as linhas que vai usar (_indice_conferido)
+    ou só precisa do cabeçalho.
+    """
+    chave = _snapshot_key(aba)
+    geracao = _geracao(aba.spreadsheet)
+    with _snapshots_lock:
+        index = _tab_indices.get(chave)
+    if (index is None or index.expirado() or refresh
+            or (index.geracao != geracao and not qualquer_geracao)):
+        header, linhas = _api(aba, 'batch_get', ['1:1', 'A2:B'])
+        index = _TabIndex(header[0] if header else [], linhas, geracao)
+        with _snapshots_lock:
+            _tab_indices[chave] = index
+    return index
+
+
+def _runs(linhas):
+    # Agrupa números de linha consecutivos em intervalos [inicio, fim]
+    runs = []
+    for linha in sorted(linhas):
+        if runs and runs[-1][1] == linha - 1:
+            runs[-1][1] = linha
+        else:
+            runs.append([linha, linha])
+    return runs
+
+
+def _primeira_linha(resposta):
+    intervalo = resposta['updates']['updatedRange'].split('!')[-1]
+    return gspread.utils.a1_to_rowcol(intervalo.split(':')[0])[0]
+
+
+def _read_sheet(worksheet, username, colunas=(), colecoes=()):
+    """Lê campos da linha do usuário e itens de coleções numa só chamada.
+
+    Retorna (campos, itens): `campos` é None se o usuário não tem linha na
+    aba principal; `itens` mapeia cada coleção para uma lista de dicts.
+    Tudo fica em cache por SNAPSHOT_TTL, então várias leituras no mesmo
+    rerun fazem no máximo uma chamada à API. Com a planilha fora do ar,
+    devolve o que estiver em memória, mesmo vencido.
+    """
+    try:
+        return _ler_planilha(worksheet, username, colunas, colecoes)
+    except Exception as e:
+        if not _indisponivel(e):
+            raise
+        return _ler_cache_antigo(worksheet, username, colunas, colecoes)
+
+
+def _ler_cache_antigo(worksheet, username, colunas, colecoes):
+    chave = _snapshot_key(worksheet)
+    with _snapshots_lock:
+        cache = _cells.get((chave, str(username)))
+        snapshot = _snapshots.get(chave)
+        itens = {}
+        for colecao in colecoes:
+            aba = _abas.get((worksheet.spreadsheet.id, colecao))
+            entrada = _itens.get((_snapshot_key(aba), str(username))) if aba is not None else None
+            itens[colecao] = [dict(item) for item in entrada.valor] if entrada is not None else []
+    if snapshot is None and worksheet is _connection.current():
+        snapshot = _ler_snapshot_local()
+    campos = None
+    if colunas:
+        row = dict(snapshot.user_row(username) or {}) if snapshot is not None else {}
+        if cache is not None:
+            row.update(cache.valor)
+        if row:
+            campos = {col: row.get(col, "") for col in colunas}
+    _marcar_degradado()
+    return campos, itens
+
+
+def _ler_planilha(worksheet, username, colunas, colecoes):
+    ranges, destinos = [], []
+    geracao = None
+
+    # Células lidas agora; só entram no cache (que é compartilhado entre
+    # sessões) depois que a leitura deu certo
+    campos, cache, novos = None, None, {}
+    if colunas:
+        row = _peek_user_row(worksheet, username)
+        if row is not None:
+            _contar_cache(True)
+            campos = {col: row.get(col, "") for col in colunas}
+        else:
+            with _snapshots_lock:
+                cache = _cells.get((_snapshot_key(worksheet), str(username)))
+            if cache is None or not _valido(worksheet.spreadsheet, cache):
+                geracao = _geracao(worksheet.spreadsheet)
+                cache = _Entrada(geracao, {})
+            faltando = [col for col in colunas if col not in cache.valor]
+            _contar_cache(not (faltando or not cache.valor))
+            if faltando or not cache.valor:
+                index = _get_index(worksheet)
+                if index.row(username) is None:
+                    index = _get_index(worksheet, refresh=True)
+                linha = index.row(username)
+                if linha is None:
+                    cache = None
+                else:
+                    for col in faltando:
+                        novos[col] = ""
+                        if col in index.colunas:
+                            ranges.append(gspread.utils.absolute_range_name(worksheet.title, index.a1(linha, col)))
+                            destinos.append((None, col))
+                    novos.setdefault('username', cache.valor.get('username', str(username)))
+
+    itens = {}
+    headers = {}
+    for colecao in colecoes:
+        aba = _get_aba(worksheet, colecao)
+        with _snapshots_lock:
+            cache_itens = _itens.get((_snapshot_key(aba), str(username)))
+        if cache_itens is not None and _valido(worksheet.spreadsheet, cache_itens):
+            _contar_cache(True)
+            itens[colecao] = [dict(item) for item in cache_itens.valor]
+            continue
+        _contar_cache(False)
+        if geracao is None:
+            geracao = _geracao(worksheet.spreadsheet)
+        index = _get_tab_index(aba)
+        headers[colecao] = (aba, index.header)
+        itens[colecao] = []
+        fim_coluna = gspread.utils.rowcol_to_a1(1, max(len(index.header), 2))[:-1]
+        for inicio, fim in _runs(linha for linha, _ in index.user_rows(username)):
+            ranges.append(gspread.utils.absolute_range_name(aba.title, f"A{inicio}:{fim_coluna}{fim}"))
+            destinos.append((colecao, None))
+
+    if ranges:
+        resposta = _api(worksheet.spreadsheet, 'values_batch_get', ranges,
+                        params={'valueRenderOption': 'UNFORMATTED_VALUE'})
+        for (colecao, col), valor_range in zip(destinos, resposta['valueRanges']):
+            valores = valor_range.get('values', [])
+            if colecao is None:
+                novos[col] = valores[0][0] if valores and valores[0] else ""
+                continue
+            header = headers[colecao][1]
+            for linha in valores:
+                item = dict(zip(header, list(linha) + [""] * (len(header) - len(linha))))
+                # A linha pode ter virado lápide depois que o índice foi lido
+                if str(item.pop('username', "")) != str(username):
+                    continue
+                itens[colecao].append(item)
+
+    with _snapshots_lock:
+        if cache is not None:
+            cache.valor.update(novos)
+            _cells[(_snapshot_key(worksheet), str(username))] = cache
+        for colecao, (aba, _) in headers.items():
+            _itens[(_snapshot_key(aba), str(username))] = _Entrada(
+                geracao, [dict(item) for item in itens[colecao]],
+            )
+
+    if cache is not None:
+        campos = {col: cache.valor[col] for col in colunas}
+    return campos, itens
+
+
+def _patch_itens(aba, username, inseridos=(), removidos=(), alterados=None):
+    # Aplica uma escrita ao cache de itens do usuário, sem ler a aba de novo
+    removidos, alterados = set(removidos), alterados or {}
+    with _snapshots_lock:
+        cache = _itens.get((_snapshot_key(aba), str(username)))
+        if cache is not None:
+            cache.valor = [
+                dict(item, **alterados.get(item['id'], {}))
+                for item in cache.valor if item['id'] not in removidos
+            ]
+            # Uma escrita refeita da fila já pode estar no cache
+            ids = {item['id'] for item in cache.valor}
+            cache.valor += [dict(item) for item in inseridos if item['id'] not in ids]
+
+
+def _append_sheet_items(worksheet, colecao, username, itens):
+    aba = _get_aba(worksheet, colecao)
+    index = _get_tab_index(aba, qualquer_geracao=True)
+    linhas = [[str(username), item['id']] + [item.get(col, "") for col in index.header[2:]] for item in itens]
+    resposta = _api(aba, 'append_rows', linhas, table_range='A1')
+    try:
+        registrado = index.add_rows(_primeira_linha(resposta), [[str(username), item['id']] for item in itens])
+    except (KeyError, TypeError):
+        registrado = False
+    if not registrado:
+        with _snapshots_lock:
+            _tab_indices.pop(_snapshot_key(aba), None)
+    _patch_itens(aba, username, inseridos=itens)
+
+
+def _indice_conferido(aba, username, ids):
+    """Índice da aba com as linhas do usuário conferidas na planilha.
+
+    Só as linhas que o índice em cache atribui ao usuário são lidas (colunas
+    A:B, numa única chamada). A aba inteira só é relida se alguma delas não
+    bate ou se falta algum dos `ids`, por exemplo um item criado por outra
+    sessão.
+    """
+    index = _get_tab_index(aba, qualquer_geracao=True)
+    linhas = index.user_rows(username)
+    if not set(ids) <= {id_ for _, id_ in linhas}:
+        return _get_tab_index(aba, refresh=True)
+    if not linhas:
+        return index
+    runs = _runs(linha for linha, _ in linhas)
+    ranges = [gspread.utils.absolute_range_name(aba.title, f"A{inicio}:B{fim}") for inicio, fim in runs]
+    resposta = _api(aba.spreadsheet, 'values_batch_get', ranges,
+                    params={'valueRenderOption': 'UNFORMATTED_VALUE'})
+    lidas = []
+    for (inicio, fim), valor_range in zip(runs, resposta['valueRanges']):
+        valores = valor_range.get('values', [])
+        valores += [[]] * (fim - inicio + 1 - len(valores))
+        lidas += [[str(v) for v in (list(linha) + ["", ""])[:2]] for linha in valores]
+    if lidas != [[str(username), id_] for _, id_ in linhas]:
+        return _get_tab_index(aba, refresh=True)
+    return index
+
+
+def _reanexar_itens(worksheet, colecao, username, itens):
+    # Anexo refeito da fila: a tentativa que falhou pode ter gravado as
+    # linhas mesmo assim, então só vão os ids que ainda não estão na aba
+    aba = _get_aba(worksheet, colecao)
+    existentes = {id_ for _, id_ in _get_tab_index(aba, refresh=True).user_rows(username)}
+    faltando = [item for item in itens if item['id'] not in existentes]
+    if faltando:
+        _append_sheet_items(worksheet, colecao, username, faltando)
+
+
+def _delete_sheet_items(worksheet, colecao, username, ids):
+    """Apaga itens deixando uma lápide: o username da linha fica em branco.
+
+    As linhas de uma aba de coleção nunca são removidas nem mudam de
+    posição enquanto o app roda; apagar uma linha deslocaria as seguintes e
+    outra sessão, com as posições antigas, gravaria no item de outro
+    usuário. As lápides são removidas pelo compactar_abas.py, com o app
+    parado.
+    """
+    aba = _get_aba(worksheet, colecao)
+    ids = set(ids)
+    index = _indice_conferido(aba, username, ids)
+    linhas = [linha for linha, id_ in index.user_rows(username) if id_ in ids]
+    if linhas:
+        data = [
+            {'range': f"A{inicio}:A{fim}", 'values': [[""]] * (fim - inicio + 1)}
+            for inicio, fim in _runs(linhas)
+        ]
+        _api(aba, 'batch_update', data)
+        index.tombstone_rows(linhas)
+    _patch_itens(aba, username, removidos=ids)
+
+
+def _update_sheet_items(worksheet, colecao, username, alteracoes):
+    aba = _get_aba(worksheet, colecao)
+    index = _indice_conferido(aba, username, alteracoes)
+    linhas = {id_: linha for linha, id_ in index.user_rows(username)}
+    data = []
+    for id_, valores in alteracoes.items():
+        if id_ not in linhas:
+            continue
+        for col, valor in valores.items():
+            if col in index.header:
+                celula = gspread.utils.rowcol_to_a1(linhas[id_], index.header.index(col) + 1)
+                data.append({'range': celula, 'values': [[valor]]})
+    if data:
+        _api(aba, 'batch_update', data)
+    _patch_itens(aba, username, alterados={id_: v for id_, v in alteracoes.items() if id_ in linhas})
+
+
+def _aplicar_transacao(worksheet, username, campos, colecoes):
+    """Grava numa única chamada o que uma transaction() acumulou.
+
+    As células da aba principal, as células alteradas e as lápides das
+    coleções vão juntas num values_batch_update, que a API aplica inteiro ou
+    não aplica. Os itens novos são anexados antes, com o username em branco
+    (como lápides, ninguém os lê), e é esse mesmo values_batch_update que
+    preenche o username. Se ele falhar, sobram só linhas em branco, que o
+    compactar_abas.py remove. Retorna False, sem gravar nada, se o usuário
+    ainda não tem linha na aba principal.
+    """
+    data = []
+    index = None
+    if campos:
+        index = _get_index(worksheet, conferir=True)
+        if index.row(username) is None or any(col not in index.colunas for col in campos):
+            index = _get_index(worksheet, refresh=True)
+        row = index.row(username)
+        if row is None:
+            return False
+        for col in [col for col in campos if col not in index.colunas]:
+            index.add_column(col)
+            data.append({'range': gspread.utils.absolute_range_name(worksheet.title, index.a1(1, col)),
+                         'values': [[col]]})
+        for col, valor in campos.items():
+            data.append({'range': gspread.utils.absolute_range_name(worksheet.title, index.a1(row, col)),
+                         'values': [[valor]]})
+
+    abas = []
+    try:
+        for colecao, (alterados, removidos, inseridos) in colecoes.items():
+            aba = _get_aba(worksheet, colecao)
+            tab = _indice_conferido(aba, username, set(alterados) | set(removidos))
+            linhas = {id_: linha for linha, id_ in tab.user_rows(username)}
+            for id_, valores in alterados.items():
+                for col, valor in valores.items():
+                    if id_ in linhas and col in tab.header:
+                        celula = gspread.utils.rowcol_to_a1(linhas[id_], tab.header.index(col) + 1)
+                        data.append({'range': gspread.utils.absolute_range_name(aba.title, celula),
+                                     'values': [[valor]]})
+            apagadas = [linhas[id_] for id_ in removidos if id_ in linhas]
+            novas = []
+            if inseridos:
+                resposta = _api(aba, 'append_rows', [
+                    ["", item['id']] + [item.get(col, "") for col in tab.header[2:]] for item in inseridos
+                ], table_range='A1')
+                try:
+                    primeira = _primeira_linha(resposta)
+                    novas = list(range(primeira, primeira + len(inseridos)))
+                except (KeyError, TypeError):
+                    # Sem a posição na resposta, procura as linhas pelos ids
+                    ids = {item['id'] for item in inseridos}
+                    tab = _get_tab_index(aba, refresh=True)
+                    novas = [i + 2 for i, (_, id_) in enumerate(tab.entradas) if id_ in ids]
+                if len(novas) != len(inseridos):
+                    raise RuntimeError(f"Linhas anexadas em {aba.title} não encontradas")
+            abas.append((aba, tab, apagadas, novas))
+            for linhas_run, valor in ((apagadas, ""), (novas, str(username))):
+                for inicio, fim in _runs(linhas_run):
+                    data.append({'range': gspread.utils.absolute_range_name(aba.title, f"A{inicio}:A{fim}"),
+                                 'values': [[valor]] * (fim - inicio + 1)})
+        if data:
+            _api(worksheet.spreadsheet, 'values_batch_update', body={'valueInputOption': 'RAW', 'data': data})
+    except Exception:
+        # Colunas criadas só no índice e linhas anexadas que ele não conhece
+        with _snapshots_lock:
+            if index is not None:
+                _indices.pop(_snapshot_key(worksheet), None)
+            for aba, _, _, _ in abas:
+                _tab_indices.pop(_snapshot_key(aba), None)
+        raise
+
+    if campos:
+        _patch_user_cache(worksheet, username, campos)
+    for (aba, tab, apagadas, novas), (alterados, removidos, inseridos) in zip(abas, colecoes.values()):
+        tab.tombstone_rows(apagadas)
+        if novas and not tab.add_rows(novas[0], [[str(username), item['id']] for item in inseridos]):
+            with _snapshots_lock:
+                _tab_indices.pop(_snapshot_key(aba), None)
+        _patch_itens(aba, username, inseridos=inseridos, removidos=removidos, alterados=alterados)
+    return True
+
+
+def _update_sheet(worksheet, df):
+    # Reescreve a planilha e já deixa o snapshot com o conteúdo gravado,
+    # para que o rerun seguinte não precise ler tudo de novo.
+    df = df.fillna("")
+    valores = [df.columns.values.tolist()] + df.values.tolist()
+    _api(worksheet, 'clear')
+    _api(worksheet, 'update', valores)
+    valores = [[str(v) for v in linha] for linha in valores]
+    snapshot = _Snapshot(valores, _geracao(worksheet.spreadsheet))
+    index = _SheetIndex(snapshot.header, [[r.get('username', '')] for r in snapshot.records], snapshot.geracao)
+    chave = _snapshot_key(worksheet)
+    with _snapshots_lock:
+        _snapshots[chave] = snapshot
+        _indices[chave] = index
+        for k in [k for k in _cells if k[0] == chave]:
+            del _cells[k]
+
+
+def _write_user_fields(worksheet, username, valores):
+    """Grava apenas as células de `valores` na linha do usuário.
+
+    Colunas que ainda não existem são criadas no cabeçalho, e a linha só é
+    anexada ao final da planilha quando o usuário ainda não tem uma.
+    """
+    colunas = ['username'] + [col for col in valores if col != 'username']
+    # A linha do usuário pode ter mudado de lugar (ordenação, linhas apagadas)
+    index = _get_index(worksheet, conferir=True)
+    if index.row(username) is None or any(col not in index.colunas for col in colunas):
+        # Antes de criar colunas ou linhas, confirma com a planilha atual
+        # para não duplicar algo criado por outra sessão.
+        index = _get_index(worksheet, refresh=True)
+
+    faltando = [col for col in colunas if col not in index.colunas]
+    data = []
+    for col in faltando:
+        index.add_column(col)
+        data.append({'range': index.a1(1, col), 'values': [[col]]})
+
+    row = index.row(username)
+    if row is not None:
+        for col, valor in valores.items():
+            data.append({'range': index.a1(row, col), 'values': [[valor]]})
+        if data:
+            _api(worksheet, 'batch_update', data)
+    else:
+        if data:
+            _api(worksheet, 'batch_update', data)
+        linha = dict(valores, username=username)
+        resposta = _api(worksheet, 'append_row', [linha.get(col, "") for col in index.header],
+                        table_range='A1')
+        try:
+            intervalo = resposta['updates']['updatedRange'].split('!')[-1]
+            index.add_row(username, gspread.utils.a1_to_rowcol(intervalo.split(':')[0])[0])
+        except (KeyError, TypeError):
+            # Sem a posição na resposta, o índice é remontado na próxima escrita
+            with _snapshots_lock:
+                _indices.pop(_snapshot_key(worksheet), None)
+
+    _patch_user_cache(worksheet, username, valores)
+
+
+def _write_many_user_fields(worksheet, valores_por_usuario):
+    """Grava campos de vários usuários existentes numa única chamada.
+
+    As colunas já precisam existir; usuários sem linha são ignorados.
+    """
+    # Posições conferidas na planilha, como em _delete_sheet_items
+    index = _get_index(worksheet, refresh=True)
+    data = []
+    for username, valores in valores_por_usuario.items():
+        row = index.row(username)
+        if row is None:
+            continue
+        for col, valor in valores.items():
+            data.append({'range': index.a1(row, col), 'values': [[valor]]})
+    if data:
+        _api(worksheet, 'batch_update', data)
+    for username, valores in valores_por_usuario.items():
+        if index.row(username) is not None:
+            _patch_user_cache(worksheet, username, valores)
+
+
+def _write_many_user_fields(worksheet, valores_por_usuario):
+    """Grava campos de vários usuários existentes numa única chamada.
+
+    As colunas já precisam existir; usuários sem linha são ignorados.
+    """
+    # Posições conferidas na planilha, como em _delete_sheet_items
+    index = _get_index(worksheet, refresh=True)
+    data = []
+    for username, valores in valores_por_usuario.items():
+        row = index.row(username)
+        if row is None:
+            continue
+        for col, valor in valores.items():
+            data.append({'range': index.a1(row, col), 'values': [[valor]]})
+    if data:
+        _api(worksheet, 'batch_update', data)
+    for username, valores in valores_por_usuario.items():
+        if index.row(username) is not None:
+            _patch_user_cache(worksheet, username, valores)
+
+
+_registro_lock = threading.Lock()
+
+
+def _append_user(worksheet, username, valores):
+    """Anexa a linha de um usuário novo; False se o username já existe.
+
+    A checagem usa o índice relido da planilha. Como duas sessões (ou dois
+    processos) podem anexar o mesmo nome ao mesmo tempo, depois do anexo as
+    linhas anteriores são conferidas: se outra chegou antes, a nossa fica
+    em branco e o registro falha. A linha não é removida, para não deslocar
+    as seguintes, cujas posições outros processos têm nos seus índices.
+    """
+    linha = dict(valores, username=str(username))
+    with _registro_lock:
+        index = _get_index(worksheet, refresh=True)
+        if index.find(username) is not None:
+            return False
+        data = []
+        for col in linha:
+            if col not in index.colunas:
+                index.add_column(col)
+                data.append({'range': index.a1(1, col), 'values': [[col]]})
+        if data:
+            _api(worksheet, 'batch_update', data)
+        resposta = _api(worksheet, 'append_row', [linha.get(col, "") for col in index.header], table_range='A1')
+        row = _primeira_linha(resposta)
+        letra = index.column_letter('username')
+        usernames = [str(u[0]) if u else "" for u in _api(worksheet, 'get', f'{letra}2:{letra}{row}')]
+        if any(u.lower() == str(username).lower() for u in usernames[:-1]):
+            if usernames and usernames[-1] == str(username):
+                fim = gspread.utils.rowcol_to_a1(row, len(index.header))
+                _api(worksheet, 'batch_update', [{'range': f"A{row}:{fim}", 'values': [[""] * len(index.header)]}])
+            with _snapshots_lock:
+                _indices.pop(_snapshot_key(worksheet), None)
+                _snapshots.pop(_snapshot_key(worksheet), None)
+            return False
+        index.add_row(username, row)
+    _patch_user_cache(worksheet, username, linha)
+    return True
+
+
+def _patch_user_cache(worksheet, username, valores):
+    # Aplica uma escrita ao cache de células e ao snapshot, sem ler de novo
+    with _snapshots_lock:
+        cache = _cells.get((_snapshot_key(worksheet), str(username)))
+        if cache is not None:
+            cache.valor.update(valores)
+        snapshot = _snapshots.get(_snapshot_key(worksheet))
+        if snapshot is not None:
+            _patch_snapshot(snapshot, username, valores)
+
+
+def _patch_snapshot(snapshot, username, valores):
+    novas = [col for col in valores if col not in snapshot.header]
+    snapshot.header += novas
+    if novas:
+        # Só uma coluna nova precisa ser preenchida em todas as linhas
+        for record in snapshot.records:
+            for col in novas:
+                record.setdefault(col, "")
+    if snapshot.user_row(username) is None:
+        snapshot.linhas[str(username)] = len(snapshot.records)
+        snapshot.records.append({col: "" for col in snapshot.header})
+    record = snapshot.user_row(username)
+    record['username'] = str(username)
+    for col, valor in valores.items():
+        record[col] = str(valor)
+
+
+class _SheetConnection:
+    """Cliente do Google Sheets compartilhado por todas as sessões do processo.
+
+    As credenciais, o gspread.authorize e a abertura da planilha acontecem uma
+    única vez; os reruns seguintes recebem a mesma aba já aberta. O token de
+    acesso é renovado automaticamente pela AuthorizedSession do google-auth.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._worksheet = None
+        self._spreadsheet_key = None
+        self._abrindo = None
+
+    def worksheet(self):
+        with self._lock:
+            if self._worksheet is None:
+                _disjuntor.permitir()
+                try:
+                    self._worksheet = self._open()
+                except Exception as e:
+                    if _indisponivel(e):
+                        _disjuntor.falha()
+                    raise
+                _disjuntor.sucesso()
+            return self._worksheet
+
+    def current(self):
+        """A aba aberta por worksheet(), ou None se ainda não abriu."""
+        return self._worksheet
+
+    def open_in_background(self):
+        """Começa a abrir a planilha numa thread, se ainda não estiver aberta."""
+        with self._lock:
+            if self._worksheet is not None or self._abrindo is not None:
+                return
+            self._abrindo = threading.Event()
+        threading.Thread(target=self._abrir_em_segundo_plano, daemon=True).start()
+
+    def _abrir_em_segundo_plano(self):
+        try:
+            self.worksheet()
+        except Exception:
+            pass
+        finally:
+            with self._lock:
+                abrindo, self._abrindo = self._abrindo, None
+            abrindo.set()
+
+    def wait(self, timeout):
+        """Espera a abertura em segundo plano; devolve a aba ou None."""
+        abrindo = self._abrindo
+        if abrindo is not None:
+            abrindo.wait(timeout)
+        return self._worksheet
+
+    def reconnect(self, objeto):
+        # Troca a sessão HTTP do cliente e força um novo token. As abas já
+        # abertas continuam válidas, pois apontam para o mesmo cliente.
+        client = objeto.client
+        client.session = AuthorizedSession(client.auth)
+        client.login()
+
+    def _open(self):
+        creds_dict = st.secrets["connections"]["gsheets"]
+
+        # Corrige a formatação da chave privada
+        private_key = creds_dict["private_key"].replace("\\n", "\n")
+
+        credentials_info = {
+            "type": creds_dict["type"],
+            "project_id": creds_dict["project_id"],
+            "private_key_id": creds_dict["private_key_id"],
+            "private_key": private_key,
+            "client_email": creds_dict["client_email"],
+            "client_id": creds_dict["client_id"],
+            "auth_uri": creds_dict["auth_uri"],
+            "token_uri": creds_dict["token_uri"],
+            "auth_provider_x509_cert_url": creds_dict["auth_provider_x509_cert_url"],
+            "client_x509_cert_url": creds_dict["client_x509_cert_url"]
+        }
+
+        scopes = [
+            "https://www.googleapis.com/auth/spreadsheets",
+            "https://www.googleapis.com/auth/drive"
+        ]
+
+        creds = Credentials.from_service_account_info(credentials_info, scopes=scopes)
+        client = gspread.authorize(creds)
+
+        # Abrir pela chave evita a busca por nome no Drive. Sem a chave nos
+        # secrets, a busca por nome é feita só na primeira conexão.
+        key = self._spreadsheet_key or creds_dict.get("spreadsheet_key")
+        if key:
+            spreadsheet = client.open_by_key(key)
+        else:
+            spreadsheet = client.open(SHEET_NAME)
+        self._spreadsheet_key = spreadsheet.id
+        return spreadsheet.get_worksheet(0)  # seleciona a primeira aba
+
+
+_connection = _SheetConnection()
+
+
+def _is_connection_error(e):
+    if isinstance(e, (RefreshError, TransportError, requests.exceptions.ConnectionError)):
+        return True
+    return isinstance(e, gspread.exceptions.APIError) and e.response.status_code == 401
+
+
+def _indisponivel(e):
+    # Erros em que vale servir dados antigos e guardar a escrita para depois
+    if isinstance(e, (_CircuitoAberto, requests.exceptions.Timeout)) or _is_connection_error(e):
+        return True
+    return isinstance(e, gspread.exceptions.APIError) and (
+        e.response.status_code == 429 or e.response.status_code >= 500
+    )
+
+
+class _CircuitoAberto(Exception):
+    pass
+
+
+class _Disjuntor:
+    """Circuit breaker das chamadas à API.
+
+    Depois de CIRCUIT_FALHAS falhas seguidas, recusa chamadas por
+    CIRCUIT_ESPERA segundos; passado esse tempo, deixa uma chamada de teste
+    passar e volta ao normal se ela der certo.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.falhas = 0
+        self.aberto_em = None
+        self.testando = False
+
+    def aberto(self):
+        with self._lock:
+            return self.aberto_em is not None and time.monotonic() - self.aberto_em < CIRCUIT_ESPERA
+
+    def permitir(self):
+        with self._lock:
+            if self.aberto_em is None:
+                return
+            if self.testando or time.monotonic() - self.aberto_em < CIRCUIT_ESPERA:
+                raise _CircuitoAberto("Google Sheets indisponível; tentando de novo em instantes.")
+            self.testando = True
+
+    def sucesso(self):
+        with self._lock:
+            self.falhas = 0
+            self.aberto_em = None
+            self.testando = False
+
+    def falha(self):
+        with self._lock:
+            self.falhas += 1
+            self.testando = False
+            if self.aberto_em is None and self.falhas < CIRCUIT_FALHAS:
+                return
+            if self.aberto_em is None:
+                _conta('circuit_open')
+            self.aberto_em = time.monotonic()
+
+
+_disjuntor = _Disjuntor()
+
+
+class _TokenBucket:
+    """Limita as chamadas à API a `por_minuto`, permitindo rajadas até esse total."""
+
+    def __init__(self, por_minuto):
+        self.capacidade = float(por_minuto)
+        self.taxa = por_minuto / 60.0
+        self.tokens = self.capacidade
+        self.atualizado_em = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Consome uma ficha, esperando se preciso. Retorna o tempo esperado."""
+        if self.capacidade <= 0:  # limite desligado
+            return 0.0
+        with self._lock:
+            agora = time.monotonic()
+            self.tokens = min(self.capacidade, self.tokens + (agora - self.atualizado_em) * self.taxa)
+            self.atualizado_em = agora
+            self.tokens -= 1
+            espera = -self.tokens / self.taxa if self.tokens < 0 else 0.0
+        if espera:
+            time.sleep(espera)
+        return espera
+
+
+def _quota_por_minuto():
+    try:
+        return int(st.secrets.get("database", {}).get("quota_per_minute", SHEETS_QUOTA_PER_MINUTE))
+    except Exception:
+        return SHEETS_QUOTA_PER_MINUTE
+
+
+_bucket = _TokenBucket(_quota_por_minuto())
+
+# Contadores do executor: chamadas feitas, esperas no limitador local,
+# respostas 429/5xx, novas tentativas, falhas definitivas e leituras que
+# aproveitaram uma chamada idêntica já em andamento (coalesced). No modo
+# degradado: aberturas do circuito, leituras servidas de dados antigos,
+# escritas enfileiradas, refeitas e descartadas.
+_api_stats = Counter()
+_api_stats_lock = threading.Lock()
+
+
+def _conta(chave, n=1):
+    with _api_stats_lock:
+        _api_stats[chave] += n
+    op = _op_atual()
+    if op is not None:
+        op.contar(op.eventos, chave, n)
+
+
+def get_api_stats():
+    with _api_stats_lock:
+        return dict(_api_stats)
+
+
+# --- Métricas por operação ---
+
+_op_local = threading.local()
+_log_metricas = logging.getLogger(__name__ + '.metricas')
+
+# Limites (em segundos) do histograma de latência no endpoint Prometheus
+_BUCKETS_LATENCIA = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+_metricas = defaultdict(Counter)
+_latencias = {}
+_metricas_lock = threading.Lock()
+_metricas_config = None
+
+
+def _hash_usuario(username):
+    # Identifica o usuário nos logs sem expor o username
+    return hashlib.sha256(str(username).encode()).hexdigest()[:12]
+
+
+def _medir_payload(valor):
+    """(linhas, bytes) aproximados de valores enviados ou recebidos da API."""
+    if isinstance(valor, dict):
+        partes = [_medir_payload(v) for v in valor.values()]
+    elif isinstance(valor, (list, tuple)):
+        if valor and not any(isinstance(v, (list, tuple, dict)) for v in valor):
+            return 1, sum(len(str(v)) for v in valor)
+        partes = [_medir_payload(v) for v in valor]
+    elif valor is None:
+        return 0, 0
+    else:
+        return 0, len(str(valor))
+    return sum(p[0] for p in partes), sum(p[1] for p in partes)
+
+
+class _Operacao:
+    """Métricas de uma chamada a uma função pública do módulo."""
+
+    def __init__(self, nome, username):
+        self.nome = nome
+        self.usuario = None if username is None else _hash_usuario(username)
+        self.chamadas = Counter()
+        self.eventos = Counter()
+        self.cache = Counter()
+        self.linhas_lidas = self.linhas_escritas = 0
+        self.bytes_lidos = self.bytes_escritos = 0
+        self.inicio = time.perf_counter()
+        self.latencia = None
+        # load_user_bundle registra chamadas de várias threads na mesma operação
+        self._lock = threading.Lock()
+
+    def registrar_chamada(self, metodo, args, resposta):
+        escrita = metodo in _METODOS_ESCRITA
+        linhas, tamanho = _medir_payload(args if escrita else resposta)
+        with self._lock:
+            self.chamadas[metodo] += 1
+            if escrita:
+                self.linhas_escritas += linhas
+                self.bytes_escritos += tamanho
+            else:
+                self.linhas_lidas += linhas
+                self.bytes_lidos += tamanho
+
+    def contar(self, contador, chave, n=1):
+        with self._lock:
+            contador[chave] += n
+
+    @property
+    def resultado_cache(self):
+        # Uma consulta que precisou da API já conta como miss
+        if self.cache['miss']:
+            return 'miss'
+        return 'hit' if self.cache['hit'] else ''
+
+    def como_dict(self):
+        return {
+            'op': self.nome,
+            'usuario': self.usuario,
+            'chamadas_api': sum(self.chamadas.values()),
+            'por_metodo': dict(self.chamadas),
+            'linhas_lidas': self.linhas_lidas,
+            'linhas_escritas': self.linhas_escritas,
+            'bytes_lidos': self.bytes_lidos,
+            'bytes_escritos': self.bytes_escritos,
+            'cache': self.resultado_cache,
+            'eventos': {k: v for k, v in self.eventos.items() if k != 'calls'},
+            'latencia_ms': round(self.latencia * 1000, 2),
+        }
+
+
+def _op_atual():
+    return getattr(_op_local, 'atual', None)
+
+
+def _contar_cache(acerto):
+    op = _op_atual()
+    if op is not None:
+        op.contar(op.cache, 'hit' if acerto else 'miss')
+
+
+def _medido(funcao):
+    """Registra uma _Operacao por chamada da função.
+
+    Chamadas aninhadas (get_convidados chamando read_user_fields) entram na
+    operação de fora, então cada chamada do app aparece uma vez só.
+    """
+    parametros = list(inspect.signature(funcao).parameters)
+    posicao = parametros.index('username') if 'username' in parametros else None
+
+    @functools.wraps(funcao)
+    def medida(*args, **kwargs):
+        if _op_atual() is not None:
+            return funcao(*args, **kwargs)
+        username = kwargs.get('username')
+        if username is None and posicao is not None and len(args) > posicao:
+            username = args[posicao]
+        op = _op_local.atual = _Operacao(funcao.__name__, username)
+        try:
+            return funcao(*args, **kwargs)
+        finally:
+            _op_local.atual = None
+            op.latencia = time.perf_counter() - op.inicio
+            _registrar_operacao(op)
+
+    return medida
+
+
+def _registrar_operacao(op):
+    config = _configurar_metricas()
+    registro = op.como_dict()
+    rerun = getattr(_op_local, 'rerun', None)
+    if rerun is not None:
+        rerun.append(registro)
+    with _metricas_lock:
+        _metricas['operacoes'][(op.nome, registro['cache'] or 'n/a')] += 1
+        _metricas['chamadas_api'][(op.nome,)] += registro['chamadas_api']
+        _metricas['linhas_lidas'][(op.nome,)] += op.linhas_lidas
+        _metricas['linhas_escritas'][(op.nome,)] += op.linhas_escritas
+        _metricas['bytes_lidos'][(op.nome,)] += op.bytes_lidos
+        _metricas['bytes_escritos'][(op.nome,)] += op.bytes_escritos
+        histograma = _latencias.setdefault(op.nome, {'buckets': [0] * len(_BUCKETS_LATENCIA), 'soma': 0.0, 'n': 0})
+        for i, limite in enumerate(_BUCKETS_LATENCIA):
+            if op.latencia <= limite:
+                histograma['buckets'][i] += 1
+        histograma['soma'] += op.latencia
+        histograma['n'] += 1
+    if 'json' in config:
+        _log_metricas.info(json.dumps(registro, ensure_ascii=False))
+
+
+def _configurar_metricas():
+    global _metricas_config
+    if _metricas_config is not None:
+        return _metricas_config
+    config = _storage_config()
+    modos = set(str(config.get("metrics", "")).replace(",", " ").lower().split())
+    with _metricas_lock:
+        if _metricas_config is not None:
+            return _metricas_config
+        _metricas_config = modos
+    if 'json' in modos and not _log_metricas.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        _log_metricas.addHandler(handler)
+        _log_metricas.setLevel(logging.INFO)
+        _log_metricas.propagate = False
+    if 'prometheus' in modos:
+        _iniciar_endpoint_metricas(config.get("metrics_host", METRICS_HOST),
+                                   int(config.get("metrics_port", METRICS_PORT)))
+    return modos
+
+
+class _MetricsHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        corpo = get_metrics_text().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(corpo)))
+        self.end_headers()
+        self.wfile.write(corpo)
+
+    def log_message(self, *args):
+        pass
+
+
+def _iniciar_endpoint_metricas(host, porta):
+    try:
+        servidor = http.server.ThreadingHTTPServer((host, porta), _MetricsHandler)
+    except OSError:
+        # Porta ocupada, por exemplo por outro processo do app na mesma máquina
+        return
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+
+
+def _rotulos(nomes, valores):
+    pares = []
+    for nome, valor in zip(nomes, valores):
+        valor = str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pares.append(f'{nome}="{valor}"')
+    return '{' + ','.join(pares) + '}'
+
+
+def get_metrics_text():
+    """Contadores das operações no formato texto do Prometheus/OpenMetrics."""
+    contadores = [
+        ('operacoes', 'cha_db_operations_total', 'Operações do database.py.', ('op', 'cache')),
+        ('chamadas_api', 'cha_db_api_calls_total', 'Chamadas à API do Google Sheets.', ('op',)),
+        ('linhas_lidas', 'cha_db_rows_read_total', 'Linhas lidas da planilha.', ('op',)),
+        ('linhas_escritas', 'cha_db_rows_written_total', 'Linhas gravadas na planilha.', ('op',)),
+        ('bytes_lidos', 'cha_db_bytes_read_total', 'Bytes (aproximados) lidos da planilha.', ('op',)),
+        ('bytes_escritos', 'cha_db_bytes_written_total', 'Bytes (aproximados) gravados na planilha.', ('op',)),
+    ]
+    linhas = []
+    with _metricas_lock:
+        for chave, nome, ajuda, rotulos in contadores:
+            linhas += [f"# HELP {nome} {ajuda}", f"# TYPE {nome} counter"]
+            for valores, total in sorted(_metricas[chave].items()):
+                linhas.append(f"{nome}{_rotulos(rotulos, valores)} {total}")
+        nome = 'cha_db_operation_seconds'
+        linhas += [f"# HELP {nome} Latência das operações do database.py.", f"# TYPE {nome} histogram"]
+        for op, histograma in sorted(_latencias.items()):
+            for limite, total in zip(_BUCKETS_LATENCIA, histograma['buckets']):
+                linhas.append(f"{nome}_bucket{_rotulos(('op', 'le'), (op, limite))} {total}")
+            linhas.append(f"{nome}_bucket{_rotulos(('op', 'le'), (op, '+Inf'))} {histograma['n']}")
+            linhas.append(f"{nome}_sum{_rotulos(('op',), (op,))} {histograma['soma']}")
+            linhas.append(f"{nome}_count{_rotulos(('op',), (op,))} {histograma['n']}")
+    nome = 'cha_db_api_events_total'
+    linhas += [f"# HELP {nome} Eventos do executor da API (ver get_api_stats).", f"# TYPE {nome} counter"]
+    for evento, total in sorted(get_api_stats().items()):
+        linhas.append(f"{nome}{_rotulos(('event',), (evento,))} {total}")
+    return "\n".join(linhas) + "\n"
+
+
+def start_rerun_metrics():
+    """Passa a guardar as operações feitas nesta thread (um rerun do Streamlit)."""
+    _op_local.rerun = []
+
+
+def get_rerun_metrics():
+    """Operações desde o último start_rerun_metrics nesta thread, como dicts."""
+    return list(getattr(_op_local, 'rerun', None) or [])
+
+
+def _is_retryable(e, anexo=False):
+    if not isinstance(e, gspread.exceptions.APIError):
+        return False
+    status = e.response.status_code
+    if status == 429:
+        _conta('rate_limited')
+    # Um 5xx num anexo pode vir depois de a linha já ter sido gravada
+    return status == 429 or (status >= 500 and not anexo)
+
+
+def _chamar(objeto, metodo, args, kwargs):
+    espera = _bucket.acquire()
+    if espera:
+        _conta('throttled')
+    _conta('calls')
+    try:
+        resposta = getattr(objeto, metodo)(*args, **kwargs)
+    except Exception as e:
+        if not _is_connection_error(e):
+            raise
+        _connection.reconnect(objeto)
+        if metodo in _METODOS_ANEXO and isinstance(e, requests.exceptions.ConnectionError):
+            # A conexão pode ter caído depois do envio; repetir duplicaria a linha
+            raise
+        resposta = getattr(objeto, metodo)(*args, **kwargs)
+    if metodo in _METODOS_ESCRITA:
+        # Leituras em andamento podem ter começado antes desta escrita
+        _single_flight.forget(_planilha_id(objeto))
+    op = _op_atual()
+    if op is not None:
+        op.registrar_chamada(metodo, args, resposta)
+    return resposta
+
+
+class _SingleFlight:
+    """Junta leituras idênticas feitas ao mesmo tempo numa só chamada.
+
+    A primeira sessão faz a chamada; as que pedirem a mesma leitura enquanto
+    ela está em andamento esperam e recebem o mesmo resultado (ou a mesma
+    exceção). Depois de uma escrita na planilha, leituras novas não se juntam
+    às que já estavam em andamento, para não receberem dados de antes dela.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._em_andamento = {}
+
+    def do(self, planilha, chave, funcao):
+        with self._lock:
+            voo = self._em_andamento.get((planilha, chave))
+            dono = voo is None
+            if dono:
+                voo = {'pronto': threading.Event(), 'resultado': None, 'erro': None}
+                self._em_andamento[(planilha, chave)] = voo
+        if not dono:
+            _conta('coalesced')
+            voo['pronto'].wait()
+            if voo['erro'] is not None:
+                raise voo['erro']
+            return voo['resultado']
+        try:
+            voo['resultado'] = funcao()
+            return voo['resultado']
+        except Exception as e:
+            voo['erro'] = e
+            raise
+        finally:
+            with self._lock:
+                if self._em_andamento.get((planilha, chave)) is voo:
+                    del self._em_andamento[(planilha, chave)]
+            voo['pronto'].set()
+
+    def forget(self, planilha):
+        with self._lock:
+            for k in [k for k in self._em_andamento if k[0] == planilha]:
+                del self._em_andamento[k]
+
+
+_single_flight = _SingleFlight()
+
+
+def _planilha_id(objeto):
+    return getattr(getattr(objeto, 'spreadsheet', objeto), 'id', None)
+
+
+def _api(objeto, metodo, *args, **kwargs):
+    """Executa uma chamada do gspread (aba ou planilha).
+
+    Toda chamada passa pelo limitador de taxa; erros 429 e 5xx são repetidos
+    com espera exponencial com jitter, e falhas de auth/rede reconectam o
+    cliente uma vez. Anexos (append_row/append_rows) só são repetidos em
+    429 e em falhas de auth, em que a API não chegou a gravar nada.
+    Leituras idênticas simultâneas viram uma só chamada.
+    """
+    if metodo in _METODOS_LEITURA:
+        chave = (getattr(objeto, 'id', id(objeto)), metodo, repr(args), repr(sorted(kwargs.items())))
+        return _single_flight.do(_planilha_id(objeto), chave,
+                                 lambda: _executar(objeto, metodo, args, kwargs))
+    return _executar(objeto, metodo, args, kwargs)
+
+
+def _executar(objeto, metodo, args, kwargs):
+    _disjuntor.permitir()
+    tentativas = tenacity.Retrying(
+        retry=tenacity.retry_if_exception(lambda e: _is_retryable(e, metodo in _METODOS_ANEXO)),
+        wait=tenacity.wait_random_exponential(multiplier=0.5, max=30),
+        stop=tenacity.stop_after_attempt(API_MAX_TENTATIVAS),
+        before_sleep=lambda estado: _conta('retried'),
+        reraise=True,
+    )
+    try:
+        resposta = tentativas(_chamar, objeto, metodo, args, kwargs)
+    except Exception as e:
+        _conta('failed')
+        # Erros como 400/404 mostram que a API está respondendo
+        if _indisponivel(e):
+            _disjuntor.falha()
+        else:
+            _disjuntor.sucesso()
+        raise
+    _disjuntor.sucesso()
+    return resposta
+
+
+_degradado_em = None
+
+
+def _marcar_degradado():
+    global _degradado_em
+    _conta('stale_reads')
+    _degradado_em = time.monotonic()
+
+
+def is_degraded():
+    """True se o app está servindo dados possivelmente desatualizados.
+
+    Vale enquanto o circuito está aberto, há escritas esperando na fila, ou
+    dados antigos foram servidos nos últimos SNAPSHOT_TTL segundos.
+    """
+    recente = _degradado_em is not None and time.monotonic() - _degradado_em <= SNAPSHOT_TTL
+    return recente or _disjuntor.aberto() or pending_write_count() > 0
+
+
+class _FilaEscritas:
+    """Escritas feitas com a planilha fora do ar, na ordem em que chegaram.
+
+    Cada escrita já aparece nos caches em memória e é refeita na planilha
+    assim que ela voltar a responder. Enquanto houver escritas na fila, as
+    novas entram atrás delas para manter a ordem.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._replay_lock = threading.Lock()
+        self.pendentes = []
+
+    def executar(self, worksheet, funcao, *args):
+        self.reaplicar()
+        with self._lock:
+            vazia = not self.pendentes
+        if vazia:
+            try:
+                return funcao(worksheet, *args)
+            except Exception as e:
+                if not _indisponivel(e):
+                    raise
+        self.enfileirar(worksheet, funcao, args)
+
+    def enfileirar(self, worksheet, funcao, args):
+        with self._lock:
+            self.pendentes.append((worksheet, funcao, args))
+        _conta('queued_writes')
+        if worksheet is not None:
+            _aplicar_localmente(worksheet, funcao, args)
+
+    def reaplicar(self):
+        """Refaz as escritas da fila, parando na primeira que falhar."""
+        if not self.pendentes or _disjuntor.aberto():
+            return
+        if not self._replay_lock.acquire(blocking=False):
+            return
+        try:
+            while True:
+                with self._lock:
+                    if not self.pendentes:
+                        return
+                    worksheet, funcao, args = self.pendentes[0]
+                if funcao is _append_sheet_items:
+                    funcao = _reanexar_itens
+                try:
+                    funcao(worksheet if worksheet is not None else _connection.worksheet(), *args)
+                    _conta('replayed')
+                except Exception as e:
+                    if _indisponivel(e):
+                        return
+                    # Erro definitivo (ex.: 400): refazer não vai adiantar
+                    _conta('replay_failed')
+                with self._lock:
+                    self.pendentes.pop(0)
+        finally:
+            self._replay_lock.release()
+
+
+_fila_escritas = _FilaEscritas()
+
+
+def pending_write_count():
+    with _fila_escritas._lock:
+        return len(_fila_escritas.pendentes)
+
+
+def _aplicar_localmente(worksheet, funcao, args):
+    # Mostra a escrita enfileirada nos caches, como se já tivesse sido feita
+    if funcao is _write_user_fields:
+        _patch_user_cache(worksheet, *args)
+        return
+    colecao, username, dados = args
+    with _snapshots_lock:
+        aba = _abas.get((worksheet.spreadsheet.id, colecao))
+    if aba is None:
+        return
+    if funcao is _append_sheet_items:
+        _patch_itens(aba, username, inseridos=dados)
+    elif funcao is _delete_sheet_items:
+        _patch_itens(aba, username, removidos=dados)
+    elif funcao is _update_sheet_items:
+        _patch_itens(aba, username, alterados=dados)
+
+
+class StorageBackend(abc.ABC):
+    """Armazenamento por trás das funções públicas deste módulo.
+
+    As funções get_*/set_* continuam recebendo o objeto devolvido por
+    connect_to_sheet(): pode ser uma aba do gspread (usada via
+    GoogleSheetsBackend) ou diretamente um backend, como o SQLiteBackend.
+    Os valores trocados aqui são brutos; a conversão fica em read_user_fields.
+    Um backend novo implementa os métodos abstratos; os demais têm uma
+    versão genérica, que ele pode trocar por uma mais eficiente.
+    """
+
+    @abc.abstractmethod
+    def fetch_users(self):
+        """Todas as linhas, como lista de dicts."""
+
+    @abc.abstractmethod
+    def replace_users(self, users_df):
+        """Substitui todo o conteúdo pelo DataFrame."""
+
+    @abc.abstractmethod
+    def read_fields(self, username, colunas):
+        """Dict coluna -> valor da linha do usuário, ou None se ela não existe."""
+
+    @abc.abstractmethod
+    def write_fields(self, username, valores):
+        """Grava as colunas de `valores`, criando a linha se preciso."""
+
+    @abc.abstractmethod
+    def columns(self):
+        """Nomes das colunas da aba principal."""
+
+    def write_users_fields(self, valores_por_usuario):
+        """Grava campos de vários usuários existentes: username -> {coluna: valor}."""
+        for username, valores in valores_por_usuario.items():
+            if self.read_fields(username, ['username']) is not None:
+                self.write_fields(username, valores)
+
+    def write_users_fields(self, valores_por_usuario):
+        """Grava campos de vários usuários existentes: username -> {coluna: valor}."""
+        for username, valores in valores_por_usuario.items():
+            if self.read_fields(username, ['username']) is not None:
+                self.write_fields(username, valores)
+
+    def add_user(self, username, valores):
+        """Cria a linha de um usuário novo; False se o username já existe."""
+        if self.find_username(username) is not None:
+            return False
+        self.write_fields(username, valores)
+        return True
+
+    def find_username(self, username):
+        """Username como está gravado, sem diferenciar maiúsculas, ou None."""
+        nome = str(username).lower()
+        for record in self.fetch_users():
+            if str(record.get('username', '')).lower() == nome:
+                return str(record['username'])
+        return None
+
+    @abc.abstractmethod
+    def read_items(self, colecao, username):
+        """Itens da coleção do usuário, como lista de dicts com 'id'."""
+
+    @abc.abstractmethod
+    def append_items(self, colecao, username, itens):
+        """Anexa `itens` (dicts com 'id') à coleção do usuário."""
+
+    @abc.abstractmethod
+    def delete_items(self, colecao, username, ids):
+        """Remove da coleção do usuário os itens com esses ids."""
+
+    @abc.abstractmethod
+    def update_items(self, colecao, username, alteracoes):
+        """Grava só as células alteradas: `alteracoes` mapeia id -> {coluna: valor}."""
+
+    def apply_changes(self, username, campos, colecoes):
+        """Grava de uma vez o que uma transaction() acumulou.
+
+        `campos` vai para write_fields; `colecoes` mapeia cada coleção para
+        (alterados, removidos, inseridos). Backends que suportam transação
+        devem aplicar tudo ou nada.
+        """
+        if campos:
+            self.write_fields(username, campos)
+        for colecao, (alterados, removidos, inseridos) in colecoes.items():
+            if alterados:
+                self.update_items(colecao, username, alterados)
+            if removidos:
+                self.delete_items(colecao, username, removidos)
+            if inseridos:
+                self.append_items(colecao, username, inseridos)
+
+    def read_bundle(self, username, colunas, colecoes):
+        """Campos e coleções do usuário de uma vez: (campos ou None, {coleção: itens})."""
+        campos = self.read_fields(username, colunas) if colunas else None
+        return campos, {colecao: self.read_items(colecao, username) for colecao in colecoes}
+
+    def append_to_lists(self, username, valores):
+        """Acrescenta um valor ao fim de cada lista de `valores` (ver LIST_SEPARATORS)."""
+        atuais = self.read_fields(username, list(valores)) or {}
+        self.write_fields(username, {
+            col: f"{atuais[col]}{LIST_SEPARATORS[col]}{valor}" if atuais.get(col, "") != "" else valor
+            for col, valor in valores.items()
+        })
+
+
+class GoogleSheetsBackend(StorageBackend):
+    def __init__(self, worksheet):
+        self.worksheet = worksheet
+
+    def fetch_users(self):
+        return _get_snapshot(self.worksheet).records
+
+    def replace_users(self, users_df):
+        _update_sheet(self.worksheet, users_df)
+
+    def read_fields(self, username, colunas):
+        return _read_sheet(self.worksheet, username, colunas)[0]
+
+    def write_fields(self, username, valores):
+        _fila_escritas.executar(self.worksheet, _write_user_fields, username, valores)
+
+    def columns(self):
+        return list(_get_index(self.worksheet).colunas)
+
+    def write_users_fields(self, valores_por_usuario):
+        _write_many_user_fields(self.worksheet, valores_por_usuario)
+
+    def write_users_fields(self, valores_por_usuario):
+        _write_many_user_fields(self.worksheet, valores_por_usuario)
+
+    def add_user(self, username, valores):
+        # Não entra na fila de escritas: sem a planilha não há como checar duplicatas
+        return _append_user(self.worksheet, username, valores)
+
+    def find_username(self, username):
+        index = _get_index(self.worksheet)
+        nome = index.find(username)
+        if nome is None and time.monotonic() - index.criado_em > SNAPSHOT_TTL:
+            # Pode ter sido registrado por outra sessão depois do índice
+            nome = _get_index(self.worksheet, refresh=True).find(username)
+        return nome
+
+    def read_items(self, colecao, username):
+        return _read_sheet(self.worksheet, username, colecoes=[colecao])[1][colecao]
+
+    def append_items(self, colecao, username, itens):
+        _fila_escritas.executar(self.worksheet, _append_sheet_items, colecao, username, itens)
+
+    def delete_items(self, colecao, username, ids):
+        _fila_escritas.executar(self.worksheet, _delete_sheet_items, colecao, username, list(ids))
+
+    def update_items(self, colecao, username, alteracoes):
+        _fila_escritas.executar(self.worksheet, _update_sheet_items, colecao, username, alteracoes)
+
+    def read_bundle(self, username, colunas, colecoes):
+        # Aba principal e abas das coleções numa única chamada à API
+        return _read_sheet(self.worksheet, username, colunas, colecoes)
+
+    def apply_changes(self, username, campos, colecoes):
+        # Uma única escrita para tudo (ver _aplicar_transacao); com escritas
+        # já na fila, cada parte entra atrás delas
+        _fila_escritas.reaplicar()
+        if pending_write_count():
+            return super().apply_changes(username, campos, colecoes)
+        try:
+            if not _aplicar_transacao(self.worksheet, username, campos, colecoes):
+                super().apply_changes(username, campos, colecoes)
+        except Exception as e:
+            if not _indisponivel(e):
+                raise
+            # A escrita pode ter chegado à planilha mesmo assim: a fila refaz
+            # cada parte, e os anexos só com os ids que ainda não estão na aba
+            if campos:
+                _fila_escritas.enfileirar(self.worksheet, _write_user_fields, (username, campos))
+            for colecao, (alterados, removidos, inseridos) in colecoes.items():
+                for funcao, dados in ((_update_sheet_items, alterados), (_delete_sheet_items, list(removidos)),
+                                      (_append_sheet_items, inseridos)):
+                    if dados:
+                        _fila_escritas.enfileirar(self.worksheet, funcao, (colecao, username, dados))
+
+
+class SQLiteBackend(StorageBackend):
+    """Backend local em SQLite: uma tabela de usuários e uma por coleção,
+    todas indexadas por username.
+
+    Útil para rodar o app e os testes sem rede, ou para instalações que
+    esbarram na cota da API do Google Sheets.
+    """
+
+    _COLUNAS_INICIAIS = USER_COLUMNS + [
+        'nome_bebe', 'sexo_bebe', 'data_cha', 'convidados',
+        'checklist_tarefas', 'checklist_status', 'orcamento',
+    ]
+    _TIPOS = {'orcamento': 'REAL', 'valor': 'REAL'}
+
+    def __init__(self, path=SQLITE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        colunas = ", ".join(self._definicao(col) for col in self._COLUNAS_INICIAIS if col != 'username')
+        with self._lock, self._conn:
+            self._conn.execute(f"CREATE TABLE IF NOT EXISTS users (username TEXT PRIMARY KEY, {colunas})")
+            for colecao, cols in COLLECTION_COLUMNS.items():
+                self._conn.execute(
+                    f"CREATE TABLE IF NOT EXISTS {colecao} (id TEXT PRIMARY KEY, username TEXT NOT NULL, "
+                    + ", ".join(self._definicao(col) for col in cols) + ")"
+                )
+                self._conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{colecao}_username ON {colecao} (username)")
+        self._colunas = self._ler_colunas()
+
+    def _definicao(self, col):
+        return f"{col} {self._TIPOS[col]}" if col in self._TIPOS else f"{col} TEXT NOT NULL DEFAULT ''"
+
+    def _ler_colunas(self):
+        return [row['name'] for row in self._conn.execute("PRAGMA table_info(users)")]
+
+    def _garantir_colunas(self, colunas):
+        # Assim como o cabeçalho da planilha, a tabela ganha colunas novas
+        # conforme o app passa a gravar campos novos.
+        for col in colunas:
+            if col not in self._colunas:
+                if not re.fullmatch(r'[A-Za-z_][A-Za-z0-9_]*', col):
+                    raise ValueError(f"Nome de coluna inválido: {col!r}")
+                self._conn.execute(f"ALTER TABLE users ADD COLUMN {col} TEXT NOT NULL DEFAULT ''")
+                self._colunas.append(col)
+
+    @staticmethod
+    def _limpar(row):
+        return {k: "" if v is None else v for k, v in dict(row).items()}
+
+    def fetch_users(self):
+        with self._lock:
+            rows = self._conn.execute("SELECT * FROM users ORDER BY rowid").fetchall()
+        return [self._limpar(row) for row in rows]
+
+    def replace_users(self, users_df):
+        users_df = users_df.fillna("")
+        colunas = list(users_df.columns)
+        with self._lock, self._conn:
+            self._garantir_colunas(colunas)
+            self._conn.execute("DELETE FROM users")
+            self._conn.executemany(
+                f"INSERT INTO users ({', '.join(colunas)}) VALUES ({', '.join('?' * len(colunas))})",
+                users_df.values.tolist(),
+            )
+
+    def read_fields(self, username, colunas):
+        existentes = [col for col in colunas if col in self._colunas]
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {', '.join(['username'] + existentes)} FROM users WHERE username = ?",
+                (str(username),),
+            ).fetchone()
+        if row is None:
+            return None
+        row = self._limpar(row)
+        return {col: row.get(col, "") for col in colunas}
+
+    def write_fields(self, username, valores):
+        with self._lock, self._conn:
+            self._write_fields(username, valores)
+
+    def _write_fields(self, username, valores):
+        colunas = [col for col in valores if col != 'username']
+        self._garantir_colunas(colunas)
+        if not colunas:
+            self._conn.execute("INSERT OR IGNORE INTO users (username) VALUES (?)", (str(username),))
+            return
+        self._conn.execute(
+            f"INSERT INTO users (username, {', '.join(colunas)}) "
+            f"VALUES (?, {', '.join('?' * len(colunas))}) "
+            f"ON CONFLICT(username) DO UPDATE SET "
+            + ", ".join(f"{col} = excluded.{col}" for col in colunas),
+            [str(username)] + [valores[col] for col in colunas],
+        )
+
+    def columns(self):
+        return list(self._colunas)
+
+    def find_username(self, username):
+        with self._lock:
+            return self._find_username(username)
+
+    def _find_username(self, username):
+        row = self._conn.execute("SELECT username FROM users WHERE username = ?", (str(username),)).fetchone()
+        if row is None:
+            row = self._conn.execute(
+                "SELECT username FROM users WHERE username = ? COLLATE NOCASE", (str(username),)
+            ).fetchone()
+        return None if row is None else row['username']
+
+    def write_users_fields(self, valores_por_usuario):
+        with self._lock, self._conn:
+            for username, valores in valores_por_usuario.items():
+                colunas = list(valores)
+                self._garantir_colunas(colunas)
+                self._conn.execute(
+                    f"UPDATE users SET {', '.join(f'{col} = ?' for col in colunas)} WHERE username = ?",
+                    [valores[col] for col in colunas] + [str(username)],
+                )
+
+    def write_users_fields(self, valores_por_usuario):
+        with self._lock, self._conn:
+            for username, valores in valores_por_usuario.items():
+                colunas = list(valores)
+                self._garantir_colunas(colunas)
+                self._conn.execute(
+                    f"UPDATE users SET {', '.join(f'{col} = ?' for col in colunas)} WHERE username = ?",
+                    [valores[col] for col in colunas] + [str(username)],
+                )
+
+    def add_user(self, username, valores):
+        with self._lock, self._conn:
+            if self._find_username(username) is not None:
+                return False
+            self._write_fields(username, valores)
+        return True
+
+    def append_to_lists(self, username, valores):
+        colunas = list(valores)
+        with self._lock, self._conn:
+            self._garantir_colunas(colunas)
+            self._conn.execute("INSERT OR IGNORE INTO users (username) VALUES (?)", (str(username),))
+            self._conn.execute(
+                "UPDATE users SET "
+                + ", ".join(f"{col} = CASE WHEN {col} = '' THEN ? ELSE {col} || '{LIST_SEPARATORS[col]}' || ? END"
+                            for col in colunas)
+                + " WHERE username = ?",
+                [v for col in colunas for v in (valores[col], valores[col])] + [str(username)],
+            )
+
+    def read_items(self, colecao, username):
+        cols = COLLECTION_COLUMNS[colecao]
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT id, {', '.join(cols)} FROM {colecao} WHERE username = ? ORDER BY rowid",
+                (str(username),),
+            ).fetchall()
+        return [self._limpar(row) for row in rows]
+
+    def append_items(self, colecao, username, itens):
+        with self._lock, self._conn:
+            self._append_items(colecao, username, itens)
+
+    def _append_items(self, colecao, username, itens):
+        cols = COLLECTION_COLUMNS[colecao]
+        self._conn.executemany(
+            f"INSERT INTO {colecao} (id, username, {', '.join(cols)}) "
+            f"VALUES (?, ?, {', '.join('?' * len(cols))})",
+            [[item['id'], str(username)] + [item.get(col, "") for col in cols] for item in itens],
+        )
+
+    def delete_items(self, colecao, username, ids):
+        with self._lock, self._conn:
+            self._delete_items(colecao, username, ids)
+
+    def _delete_items(self, colecao, username, ids):
+        self._conn.executemany(
+            f"DELETE FROM {colecao} WHERE username = ? AND id = ?",
+            [(str(username), id_) for id_ in ids],
+        )
+
+    def update_items(self, colecao, username, alteracoes):
+        with self._lock, self._conn:
+            self._update_items(colecao, username, alteracoes)
+
+    def _update_items(self, colecao, username, alteracoes):
+        for id_, valores in alteracoes.items():
+            cols = [col for col in valores if col in COLLECTION_COLUMNS[colecao]]
+            if cols:
+                self._conn.execute(
+                    f"UPDATE {colecao} SET {', '.join(f'{col} = ?' for col in cols)} "
+                    f"WHERE username = ? AND id = ?",
+                    [valores[col] for col in cols] + [str(username), id_],
+                )
+
+    def apply_changes(self, username, campos, colecoes):
+        # Tudo numa única transação do SQLite: ou grava tudo, ou nada
+        with self._lock, self._conn:
+            if campos:
+                self._write_fields(username, campos)
+            for colecao, (alterados, removidos, inseridos) in colecoes.items():
+                self._update_items(colecao, username, alterados)
+                self._delete_items(colecao, username, removidos)
+                self._append_items(colecao, username, inseridos)
+
+
+class _Transacao(StorageBackend):
+    """Acumula as escritas de um usuário para gravá-las juntas no fim.
+
+    Lê do backend real com as alterações pendentes aplicadas por cima, para
+    que get_* dentro do bloco já vejam o que foi alterado.
+    """
+
+    def __init__(self, backend, username):
+        self.backend = backend
+        self.username = str(username)
+        self.campos = {}
+        self.colecoes = {}
+        self.usuarios = None
+        self.sucesso = None
+
+    def _conferir(self, username):
+        if str(username) != self.username:
+            raise ValueError(f"A transação é do usuário {self.username!r}, não de {username!r}")
+
+    def _colecao(self, colecao):
+        # (alterados, removidos, inseridos)
+        return self.colecoes.setdefault(colecao, ({}, [], {}))
+
+    def fetch_users(self):
+        if self.usuarios is not None:
+            return self.usuarios.fillna("").to_dict('records')
+        return self.backend.fetch_users()
+
+    def replace_users(self, users_df):
+        # Gravado no commit, antes dos campos e coleções do usuário
+        self.usuarios = users_df.copy()
+
+    def find_username(self, username):
+        if self.usuarios is not None:
+            return super().find_username(username)
+        return self.backend.find_username(username)
+
+    def columns(self):
+        colunas = list(self.usuarios.columns) if self.usuarios is not None else self.backend.columns()
+        return colunas + [col for col in self.campos if col not in colunas]
+
+    def _ler_campos(self, username, colunas):
+        if self.usuarios is None:
+            return self.backend.read_fields(username, colunas)
+        for record in self.fetch_users():
+            if str(record.get('username', '')) == str(username):
+                return {col: record.get(col, "") for col in colunas}
+        return None
+
+    def read_fields(self, username, colunas):
+        self._conferir(username)
+        faltando = [col for col in colunas if col not in self.campos]
+        row = self._ler_campos(username, faltando) if faltando else None
+        if row is None:
+            if faltando and not self.campos:
+                return None
+            row = {col: "" for col in faltando}
+        return {col: self.campos[col] if col in self.campos else row[col] for col in colunas}
+
+    def write_fields(self, username, valores):
+        self._conferir(username)
+        self.campos.update(valores)
+
+    def read_items(self, colecao, username):
+        self._conferir(username)
+        alterados, removidos, inseridos = self.colecoes.get(colecao, ({}, [], {}))
+        itens = [
+            dict(item, **alterados.get(item['id'], {}))
+            for item in self.backend.read_items(colecao, username)
+            if item['id'] not in removidos
+        ]
+        return itens + [dict(item) for item in inseridos.values()]
+
+    def append_items(self, colecao, username, itens):
+        self._conferir(username)
+        _, _, inseridos = self._colecao(colecao)
+        for item in itens:
+            inseridos[item['id']] = dict(item)
+
+    def delete_items(self, colecao, username, ids):
+        self._conferir(username)
+        alterados, removidos, inseridos = self._colecao(colecao)
+        for id_ in ids:
+            if inseridos.pop(id_, None) is None and id_ not in removidos:
+                removidos.append(id_)
+            alterados.pop(id_, None)
+
+    def update_items(self, colecao, username, alteracoes):
+        self._conferir(username)
+        alterados, removidos, inseridos = self._colecao(colecao)
+        for id_, valores in alteracoes.items():
+            if id_ in inseridos:
+                inseridos[id_].update(valores)
+            elif id_ not in removidos:
+                alterados.setdefault(id_, {}).update(valores)
+
+    def commit(self):
+        colecoes = {
+            colecao: (alterados, removidos, list(inseridos.values()))
+            for colecao, (alterados, removidos, inseridos) in self.colecoes.items()
+            if alterados or removidos or inseridos
+        }
+        if self.usuarios is not None:
+            self.backend.replace_users(self.usuarios)
+        if self.campos or colecoes:
+            self.backend.apply_changes(self.username, self.campos, colecoes)
+
+
+@contextlib.contextmanager
+def transaction(worksheet, username):
+    """Agrupa vários set_*/add_* do mesmo usuário numa única gravação.
+
+        with database.transaction(sheet, username) as tx:
+            database.set_evento_atual(tx, username, evento)
+            database.set_orcamento(tx, username, orcamento)
+        if tx.sucesso: ...
+
+    Os campos da aba principal vão numa só escrita e as alterações de cada
+    coleção são agrupadas. Se o bloco levantar uma exceção, nada é gravado.
+    No SQLite tudo é aplicado numa transação; no Google Sheets, num único
+    values_batch_update (ver _aplicar_transacao).
+    """
+    # O que estiver no buffer do checklist entra antes, para não ser
+    # sobrescrito depois pelo estado antigo
+    _checklist_buffer.flush(worksheet, username)
+    tx = _Transacao(_backend(worksheet), username)
+    yield tx
+    try:
+        tx.commit()
+        if any(col in tx.campos for col in ('checklist_tarefas', 'checklist_status')):
+            _checklist_buffer.discard(worksheet, username)
+        tx.sucesso = True
+    except Exception as e:
+        st.error(f"Erro ao salvar alterações: {e}")
+        tx.sucesso = False
+
+
+class _OfflineSheet(StorageBackend):
+    """Aba principal a partir da cópia local, enquanto a planilha não abre.
+
+    A lista de usuários (tela de login) sai direto da cópia. A primeira
+    das demais operações espera até CONNECT_TIMEOUT pela abertura em
+    segundo plano; se ela não termina a tempo, as seguintes não esperam
+    mais e só usam a planilha quando ela já estiver aberta. Sem a planilha,
+    as leituras saem da cópia e as escritas vão para a fila, para serem
+    refeitas quando a conexão voltar. As coleções não têm cópia em disco,
+    então começam vazias.
+    """
+
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+        self.itens = {}
+        self.esgotado = False
+
+    def _online(self):
+        if self.esgotado:
+            worksheet = _connection.current()
+        else:
+            worksheet = _connection.wait(CONNECT_TIMEOUT)
+            self.esgotado = worksheet is None
+        if worksheet is None:
+            _marcar_degradado()
+            return None
+        return _backend(worksheet)
+
+    def fetch_users(self):
+        worksheet = _connection.current()
+        if worksheet is not None:
+            return _backend(worksheet).fetch_users()
+        return self.snapshot.records
+
+    def columns(self):
+        online = self._online()
+        return online.columns() if online else list(self.snapshot.header)
+
+    def find_username(self, username):
+        online = self._online()
+        return online.find_username(username) if online else super().find_username(username)
+
+    def add_user(self, username, valores):
+        online = self._online()
+        if not online:
+            raise _CircuitoAberto("Google Sheets indisponível; tente de novo em instantes.")
+        return online.add_user(username, valores)
+
+    def replace_users(self, users_df):
+        # Reescrever a planilha inteira a partir da cópia local perderia o que
+        # mudou desde que ela foi salva
+        online = self._online()
+        if not online:
+            raise _CircuitoAberto("Google Sheets indisponível; tente de novo em instantes.")
+        return online.replace_users(users_df)
 
-# Nome da planilha no Google Sheets
-SHEET_NAME = 'ChaDeBebe_DB'
+    def read_fields(self, username, colunas):
+        online = self._online()
+        if online:
+            return online.read_fields(username, colunas)
+        row = self.snapshot.user_row(username)
+        return None if row is None else {col: row.get(col, "") for col in colunas}
 
-def connect_to_sheet():
-    try:
-        creds_dict = st.secrets["connections"]["gsheets"]
+    def read_bundle(self, username, colunas, colecoes):
+        online = self._online()
+        if online:
+            return online.read_bundle(username, colunas, colecoes)
+        return super().read_bundle(username, colunas, colecoes)
 
-        # Corrige a formatação da chave privada
-        private_key = creds_dict["private_key"].replace("\\n", "\n")
+    def write_fields(self, username, valores):
+        online = self._online()
+        if online:
+            return online.write_fields(username, valores)
+        _fila_escritas.enfileirar(None, _write_user_fields, (username, valores))
+        _patch_snapshot(self.snapshot, username, valores)
 
-        credentials_info = {
-            "type": creds_dict["type"],
-            "project_id": creds_dict["project_id"],
-            "private_key_id": creds_dict["private_key_id"],
-            "private_key": private_key,
-            "client_email": creds_dict["client_email"],
-            "client_id": creds_dict["client_id"],
-            "auth_uri": creds_dict["auth_uri"],
-            "token_uri": creds_dict["token_uri"],
-            "auth_provider_x509_cert_url": creds_dict["auth_provider_x509_cert_url"],
-            "client_x509_cert_url": creds_dict["client_x509_cert_url"]
-        }
+    def write_users_fields(self, valores_por_usuario):
+        online = self._online()
+        if online:
+            return online.write_users_fields(valores_por_usuario)
+        _fila_escritas.enfileirar(None, _write_many_user_fields, (valores_por_usuario,))
+        for username, valores in valores_por_usuario.items():
+            _patch_snapshot(self.snapshot, username, valores)
 
-        scopes = [
-            "https://www.googleapis.com/auth/spreadsheets",
-            "https://www.googleapis.com/auth/drive"
-        ]
+    def read_items(self, colecao, username):
+        online = self._online()
+        if online:
+            return online.read_items(colecao, username)
+        return [dict(item) for item in self.itens.get((colecao, str(username)), [])]
 
-        creds = Credentials.from_service_account_info(credentials_info, scopes=scopes)
-        client = gspread.authorize(creds)
-        spreadsheet = client.open(SHEET_NAME)
-        worksheet = spreadsheet.get_worksheet(0)  # seleciona a primeira aba
+    def append_items(self, colecao, username, itens):
+        online = self._online()
+        if online:
+            return online.append_items(colecao, username, itens)
+        _fila_escritas.enfileirar(None, _append_sheet_items, (colecao, username, itens))
+        self.itens.setdefault((colecao, str(username)), []).extend(dict(item) for item in itens)
+
+    def delete_items(self, colecao, username, ids):
+        online = self._online()
+        if online:
+            return online.delete_items(colecao, username, ids)
+        ids = list(ids)
+        _fila_escritas.enfileirar(None, _delete_sheet_items, (colecao, username, ids))
+        chave = (colecao, str(username))
+        self.itens[chave] = [item for item in self.itens.get(chave, []) if item['id'] not in ids]
+
+    def update_items(self, colecao, username, alteracoes):
+        online = self._online()
+        if online:
+            return online.update_items(colecao, username, alteracoes)
+        _fila_escritas.enfileirar(None, _update_sheet_items, (colecao, username, alteracoes))
+        for item in self.itens.get((colecao, str(username)), []):
+            item.update(alteracoes.get(item['id'], {}))
+
+
+_offline = None
+
+
+def _offline_sheet():
+    global _offline
+    with _snapshots_lock:
+        if _offline is None:
+            snapshot = _ler_snapshot_local()
+            if snapshot is not None:
+                _offline = _OfflineSheet(snapshot)
+        return _offline
+
+
+def _backend(worksheet):
+    if isinstance(worksheet, StorageBackend):
         return worksheet
+    # Escritas guardadas durante uma queda vão antes de qualquer leitura nova
+    _fila_escritas.reaplicar()
+    return GoogleSheetsBackend(worksheet)
 
+
+def _storage_config():
+    # [database] nos secrets, ou CHA_DB_BACKEND / CHA_DB_PATH no ambiente
+    config = {}
+    try:
+        config.update(st.secrets.get("database", {}))
+    except Exception:
+        pass
+    if os.environ.get("CHA_DB_BACKEND"):
+        config["backend"] = os.environ["CHA_DB_BACKEND"]
+    if os.environ.get("CHA_DB_PATH"):
+        config["path"] = os.environ["CHA_DB_PATH"]
+    if os.environ.get("CHA_METRICS"):
+        config["metrics"] = os.environ["CHA_METRICS"]
+    if os.environ.get("CHA_METRICS_PORT"):
+        config["metrics_port"] = os.environ["CHA_METRICS_PORT"]
+    if os.environ.get("CHA_METRICS_HOST"):
+        config["metrics_host"] = os.environ["CHA_METRICS_HOST"]
+    return config
+
+
+_sqlite_backends = {}
+
+
+@_medido
+def connect_to_sheet(offline=True):
+    """Aba principal (ou backend) usada por todas as funções deste módulo.
+
+    Com offline=True, enquanto a planilha abre a primeira tela é servida da
+    cópia local. Scripts de linha de comando passam offline=False para
+    esperar a planilha e falar sempre direto com ela.
+    """
+    global _offline
+    try:
+        config = _storage_config()
+        if config.get("backend", "sheets") == "sqlite":
+            path = config.get("path", SQLITE_PATH)
+            with _snapshots_lock:
+                if path not in _sqlite_backends:
+                    _sqlite_backends[path] = SQLiteBackend(path)
+                return _sqlite_backends[path]
+        if offline and _connection.current() is None:
+            copia = _offline_sheet()
+            if copia is not None:
+                # A primeira tela sai da cópia local; a planilha abre em paralelo
+                _connection.open_in_background()
+                return copia
+        worksheet = _connection.worksheet()
+        _offline = None
+        _fila_escritas.reaplicar()
+        if offline:
+            _iniciar_copia_local()
+        return worksheet
     except Exception as e:
         st.error(f"Erro ao conectar à planilha: {e}")
         return None
 
 
+def _novo_id():
+    return uuid.uuid4().hex[:12]
+
+
+def _itens_para_df(colecao, itens):
+    # DataFrame da coleção com o id de cada item numa coluna comum; o índice
+    # fica o padrão (0, 1, ...) para o st.data_editor conseguir criar linhas.
+    # Nas páginas a coluna id é escondida com column_config={'id': None}.
+    return pd.DataFrame(itens, columns=['id'] + COLLECTION_COLUMNS[colecao])
+
+
+def _itens_do_df(colecao, df):
+    """Converte o DataFrame da página em itens, mantendo os ids já existentes."""
+    cols = COLLECTION_COLUMNS[colecao]
+    df = df.reindex(columns=['id'] + cols)
+    df = df.astype(object).where(df.notna(), "")
+    itens, vistos = [], set()
+    for id_, *linha in df.values.tolist():
+        if not isinstance(id_, str) or not id_ or id_ in vistos:
+            id_ = _novo_id()
+        vistos.add(id_)
+        itens.append(dict(zip(cols, linha), id=id_))
+    return itens
+
+
+def _get_colecao(worksheet, username, colecao):
+    return _itens_para_df(colecao, _backend(worksheet).read_items(colecao, username))
+
+
+def _set_colecao(worksheet, username, colecao, df):
+    backend = _backend(worksheet)
+    antigos = [item['id'] for item in backend.read_items(colecao, username)]
+    if antigos:
+        backend.delete_items(colecao, username, antigos)
+    novos = _itens_do_df(colecao, df)
+    if novos:
+        backend.append_items(colecao, username, novos)
+
+
+def _diff_colecao(colecao, original_df, editado_df):
+    """Compara a coleção carregada com a editada na página.
+
+    Retorna (inseridos, alterados, removidos): itens novos, um dict
+    id -> {coluna: valor} só com as células que mudaram, e os ids que saíram.
+    """
+    originais = {item['id']: item for item in _itens_do_df(colecao, original_df)}
+    inseridos, alterados, vistos = [], {}, set()
+    for item in _itens_do_df(colecao, editado_df):
+        antigo = originais.get(item['id'])
+        if antigo is None:
+            inseridos.append(item)
+            continue
+        vistos.add(item['id'])
+        mudancas = {col: item[col] for col in COLLECTION_COLUMNS[colecao] if item[col] != antigo[col]}
+        if mudancas:
+            alterados[item['id']] = mudancas
+    removidos = [id_ for id_ in originais if id_ not in vistos]
+    return inseridos, alterados, removidos
+
+
+def _add_item(worksheet, username, colecao, item):
+    # Só anexa o item novo; a coleção já gravada não é lida nem reescrita
+    _backend(worksheet).append_items(colecao, username, [dict(item, id=_novo_id())])
+
+
+@_medido
+def migrate_json_collections(worksheet):
+    """Move as coleções gravadas como JSON na aba principal para as abas próprias.
+
+    Pode ser executada de novo após uma interrupção: a coleção de um usuário
+    que já tem itens na aba nova não é copiada outra vez, e a célula JSON só
+    é apagada depois da cópia. Retorna quantas coleções foram migradas.
+    """
+    backend = _backend(worksheet)
+    migradas = 0
+    for record in backend.fetch_users():
+        username = record.get('username')
+        legado = {col: record.get(col) for col in COLLECTION_COLUMNS if record.get(col)}
+        if not username or not legado:
+            continue
+        for colecao, valor in legado.items():
+            if not backend.read_items(colecao, username):
+                itens = _itens_do_df(colecao, _parse(colecao, valor).reset_index(drop=True))
+                if itens:
+                    backend.append_items(colecao, username, itens)
+            migradas += 1
+        backend.write_fields(username, {colecao: "" for colecao in legado})
+    return migradas
+
+
+@_medido
+def compact_collections(worksheet):
+    """Remove das abas de coleção as linhas de itens apagados (username em branco).
+
+    Desloca as linhas seguintes, por isso só deve rodar com o app parado
+    (ver compactar_abas.py). Retorna quantas linhas foram removidas.
+    """
+    removidas = 0
+    for colecao in COLLECTION_COLUMNS:
+        aba = _get_aba(worksheet, colecao)
+        valores = _api(aba, 'batch_get', ['A2:B'])[0]
+        linhas = [i + 2 for i, linha in enumerate(valores) if not linha or not str(linha[0]).strip()]
+        if linhas:
+            pedidos = [
+                {'deleteDimension': {'range': {
+                    'sheetId': aba.id, 'dimension': 'ROWS', 'startIndex': inicio - 1, 'endIndex': fim,
+                }}}
+                for inicio, fim in reversed(_runs(linhas))
+            ]
+            _api(worksheet.spreadsheet, 'batch_update', {'requests': pedidos})
+            removidas += len(linhas)
+        with _snapshots_lock:
+            _tab_indices.pop(_snapshot_key(aba), None)
+    return removidas
+
+
+@_medido
+def read_user_fields(worksheet, username, colunas):
+    """Lê só as colunas pedidas da linha do usuário, já convertidas.
+
+    Retorna None se o usuário não tem linha. Colunas inexistentes voltam com
+    o valor vazio do seu tipo (lista vazia, 0.0, DataFrame vazio).
+    """
+    row = _backend(worksheet).read_fields(username, colunas)
+    if row is None:
+        return None
+    return {col: _parse(col, row[col]) for col in colunas}
+
+
+@_medido
 def fetch_all_users(worksheet):
     try:
-        records = worksheet.get_all_records()
+        # Linhas em branco (ex.: de um registro que perdeu a corrida) ficam de fora
+        records = [r for r in _backend(worksheet).fetch_users() if str(r.get('username', ''))]
         if not records:
-            return pd.DataFrame(columns=['username', 'email', 'name', 'password'])
+            return pd.DataFrame(columns=USER_COLUMNS)
         df = pd.DataFrame(records)
-        for col in ['username', 'email', 'name', 'password']:
+        for col in USER_COLUMNS:
             if col not in df.columns:
                 df[col] = ""
-        return df[['username', 'email', 'name', 'password']]
+        return df[USER_COLUMNS]
     except Exception as e:
         st.error(f"Erro ao buscar usuários: {e}")
-        return pd.DataFrame(columns=['username', 'email', 'name', 'password'])
+        return pd.DataFrame(columns=USER_COLUMNS)
+
+
+@_medido
+def get_user_credentials(worksheet, username):
+    """Email, nome e senha (hash) de um usuário, ou None se ele não existe.
+
+    O username não diferencia maiúsculas, como no streamlit_authenticator.
+    Só a linha desse usuário é lida, não a tabela inteira.
+    """
+    try:
+        backend = _backend(worksheet)
+        nome = backend.find_username(username)
+        if nome is None:
+            return None
+        row = backend.read_fields(nome, ['email', 'name', 'password'])
+        if row is None:
+            return None
+        return {col: str(row[col]) for col in ('email', 'name', 'password')}
+    except Exception as e:
+        st.error(f"Erro ao buscar usuário: {e}")
+        return None
+
+
+@_medido
+def update_user_fields(worksheet, valores_por_usuario):
+    """Grava campos de vários usuários de uma vez (username -> {coluna: valor}).
+
+    Só as células informadas são escritas, numa única chamada no Google
+    Sheets; usuários que não existem são ignorados.
+    """
+    try:
+        _backend(worksheet).write_users_fields(valores_por_usuario)
+        return True
+    except Exception as e:
+        st.error(f"Erro ao atualizar usuários: {e}")
+        return False
+
+
+@_medido
+def update_user_fields(worksheet, valores_por_usuario):
+    """Grava campos de vários usuários de uma vez (username -> {coluna: valor}).
+
+    Só as células informadas são escritas, numa única chamada no Google
+    Sheets; usuários que não existem são ignorados.
+    """
+    try:
+        _backend(worksheet).write_users_fields(valores_por_usuario)
+        return True
+    except Exception as e:
+        st.error(f"Erro ao atualizar usuários: {e}")
+        return False
+
+
+def register_user(worksheet, username, email, name, password_hash):
+    """Grava um usuário novo anexando uma única linha.
+
+    Retorna False (com uma mensagem) se o username já existe, sem
+    diferenciar maiúsculas; os dados dos outros usuários não são tocados.
+    """
+    try:
+        criado = _backend(worksheet).add_user(username, {
+            'email': email, 'name': name, 'password': password_hash,
+        })
+        if not criado:
+            st.error(f"O usuário '{username}' já existe.")
+        return criado
+    except Exception as e:
+        st.error(f"Erro ao registrar usuário: {e}")
+        return False
+
+
+class UserCredentials(MutableMapping):
+    """credentials['usernames'] do streamlit_authenticator, lido sob demanda.
 
+    No login o Authenticate só consulta o username digitado (ou o do
+    cookie), então cada rerun lê uma linha em vez da tabela inteira. Só
+    percorrer o mapeamento (ex.: recuperação de usuário por email) carrega
+    todos os usuários. O que o autenticador altera aqui (registro, nova
+    senha) fica em memória; gravar na planilha continua a cargo do app, e
+    os usuários registrados no rerun ficam em `novos`.
 
+        authenticator = stauth.Authenticate({'usernames': {}}, ...)
+        authenticator.credentials['usernames'] = database.UserCredentials(sheet)
+    """
+
+    def __init__(self, worksheet):
+        self.worksheet = worksheet
+        self._usuarios = {}
+        self._removidos = set()
+        self.novos = {}
+
+    def __getitem__(self, username):
+        chave = str(username).lower()
+        if chave in self._removidos:
+            raise KeyError(username)
+        if chave not in self._usuarios:
+            usuario = get_user_credentials(self.worksheet, chave)
+            if usuario is None:
+                raise KeyError(username)
+            self._usuarios[chave] = usuario
+        return self._usuarios[chave]
+
+    def __setitem__(self, username, valor):
+        chave = str(username).lower()
+        self._removidos.discard(chave)
+        self._usuarios[chave] = valor
+        # O autenticador só atribui um username inteiro ao registrar alguém
+        self.novos[chave] = valor
+
+    def __delitem__(self, username):
+        self[username]
+        chave = str(username).lower()
+        self._usuarios.pop(chave, None)
+        self._removidos.add(chave)
+
+    def _carregar_todos(self):
+        users_df = fetch_all_users(self.worksheet)
+        for record in users_df.to_dict('records'):
+            chave = str(record.pop('username')).lower()
+            if chave and chave not in self._removidos:
+                self._usuarios.setdefault(chave, {k: str(v) for k, v in record.items()})
+
+    def __iter__(self):
+        self._carregar_todos()
+        return iter(list(self._usuarios))
+
+    def __len__(self):
+        self._carregar_todos()
+        return len(self._usuarios)
+
+
+@_medido
 def update_users(worksheet, users_df):
     try:
-        users_df = users_df.fillna("")
-        worksheet.clear()
-        worksheet.update([users_df.columns.values.tolist()] + users_df.values.tolist())
+        _backend(worksheet).replace_users(users_df)
         return True
     except Exception as e:
         st.error(f"Erro ao atualizar usuários: {e}")
         return False
 
 
+@_medido
 def get_evento_atual(worksheet, username):
     try:
-        records = worksheet.get_all_records()
-        if not records:
-            return {}
-        df = pd.DataFrame(records)
-        if 'username' not in df.columns:
-            return {}
-        user_evento = df[df['username'] == username]
-        if user_evento.empty:
-            return {}
-        row = user_evento.iloc[0]
-        return {
-            "nome_bebe": row.get("nome_bebe", ""),
-            "sexo_bebe": row.get("sexo_bebe", ""),
-            "data_cha": row.get("data_cha", ""),
-        }
+        return read_user_fields(worksheet, username, ["nome_bebe", "sexo_bebe", "data_cha"]) or {}
     except Exception as e:
         st.error(f"Erro ao buscar evento: {e}")
         return {}
 
 
+@_medido
 def set_evento_atual(worksheet, username, evento_data):
     try:
-        records = worksheet.get_all_records()
-        if not records:
-            df = pd.DataFrame(columns=["username","nome_bebe","sexo_bebe","data_cha","email","name","password"])
-        else:
-            df = pd.DataFrame(records)
-
-        if 'username' not in df.columns:
-            df = pd.DataFrame(columns=["username","nome_bebe","sexo_bebe","data_cha","email","name","password"])
-
-        idx = df.index[df['username'] == username].tolist()
-
-        if not idx:
-            nova_linha = {
-                "username": username,
-                "nome_bebe": evento_data.get("nome_bebe", ""),
-                "sexo_bebe": evento_data.get("sexo_bebe", ""),
-                "data_cha": evento_data.get("data_cha", ""),
-                "email": "",
-                "name": "",
-                "password": "",
-            }
-            df = pd.concat([df, pd.DataFrame([nova_linha])], ignore_index=True)
-        else:
-            i = idx[0]
-            df.at[i, "nome_bebe"] = evento_data.get("nome_bebe", "")
-            df.at[i, "sexo_bebe"] = evento_data.get("sexo_bebe", "")
-            df.at[i, "data_cha"] = evento_data.get("data_cha", "")
-
-        df = df.fillna("")
-        worksheet.clear()
-        worksheet.update([df.columns.values.tolist()] + df.values.tolist())
+        _backend(worksheet).write_fields(username, {
+            "nome_bebe": evento_data.get("nome_bebe", ""),
+            "sexo_bebe": evento_data.get("sexo_bebe", ""),
+            "data_cha": evento_data.get("data_cha", ""),
+        })
         return True
     except Exception as e:
         st.error(f"Erro ao salvar evento: {e}")
         return False
 
 
+@_medido
 def get_convidados(worksheet, username):
     try:
-        records = worksheet.get_all_records()
-        if not records:
-            return []
-        df = pd.DataFrame(records)
-        if 'username' not in df.columns or 'convidados' not in df.columns:
-            return []
-        convidados_str = df.loc[df['username'] == username, 'convidados'].values
-        if convidados_str.size == 0 or not convidados_str[0]:
-            return []
-        return convidados_str[0].split(',')
+        row = read_user_fields(worksheet, username, ['convidados'])
+        return row['convidados'] if row else []
     except Exception as e:
         st.error(f"Erro ao obter convidados: {e}")
         return []
 
 
+@_medido
 def set_convidados(worksheet, username, convidados_list):
     try:
-        records = worksheet.get_all_records()
-        if not records:
-            df = pd.DataFrame(columns=["username", "convidados"])
-        else:
-            df = pd.DataFrame(records)
-
-        if 'username' not in df.columns:
-            df['username'] = ""
-        if 'convidados' not in df.columns:
-            df['convidados'] = ""
-
-        idx = df.index[df['username'] == username].tolist()
-        convidados_str = ",".join(convidados_list)
-        if not idx:
-            nova_linha = {"username": username, "convidados": convidados_str}
-            df = pd.concat([df, pd.DataFrame([nova_linha])], ignore_index=True)
-        else:
-            i = idx[0]
-            df.at[i, "convidados"] = convidados_str
-        df = df.fillna("")
-        worksheet.clear()
-        worksheet.update([df.columns.values.tolist()] + df.values.tolist())
+        _backend(worksheet).write_fields(username, {"convidados": ",".join(convidados_list)})
         return True
     except Exception as e:
         st.error(f"Erro ao salvar convidados: {e}")
         return False
 
 
+@_medido
+def add_convidado(worksheet, username, nome):
+    """Acrescenta um convidado sem reler nem regravar a lista inteira."""
+    try:
+        _backend(worksheet).append_to_lists(username, {"convidados": nome})
+        return True
+    except Exception as e:
+        st.error(f"Erro ao adicionar convidado: {e}")
+        return False
+
+
+def _write_checklist(worksheet, username, tarefas, status):
+    _backend(worksheet).write_fields(username, {
+        "checklist_tarefas": ';'.join(tarefas),
+        "checklist_status": ';'.join(map(str, status)),
+    })
+
+
+class _ChecklistWriteBehind:
+    """Guarda o último estado do checklist de cada usuário e grava uma vez só.
+
+    Cada clique substitui o estado pendente e reinicia a espera; a gravação
+    acontece CHECKLIST_DEBOUNCE segundos depois do último clique, ou antes,
+    quando flush() é chamado (por exemplo, ao trocar de página). Se a
+    gravação falha, o estado continua pendente, o erro fica em error() e
+    uma nova tentativa é agendada, com espera dobrando até
+    CHECKLIST_RETRY_MAX segundos.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pendentes = {}
+        self._timers = {}
+        self._erros = {}
+
+    def schedule(self, worksheet, username, tarefas, status):
+        chave = (id(worksheet), str(username))
+        with self._lock:
+            self._pendentes[chave] = (worksheet, username, list(tarefas), list(status))
+            self._agendar(chave, CHECKLIST_DEBOUNCE)
+
+    def _agendar(self, chave, espera):
+        # Chamado com self._lock
+        timer = self._timers.pop(chave, None)
+        if timer is not None:
+            timer.cancel()
+        timer = threading.Timer(espera, self._flush_chave, args=(chave,))
+        timer.daemon = True
+        self._timers[chave] = timer
+        timer.start()
+
+    def pending(self, worksheet, username):
+        with self._lock:
+            pendente = self._pendentes.get((id(worksheet), str(username)))
+        return None if pendente is None else (list(pendente[2]), list(pendente[3]))
+
+    def error(self, worksheet, username):
+        """Mensagem da última gravação que falhou, ou None."""
+        with self._lock:
+            erro = self._erros.get((id(worksheet), str(username)))
+        return None if erro is None else erro[0]
+
+    def discard(self, worksheet, username):
+        chave = (id(worksheet), str(username))
+        with self._lock:
+            self._pendentes.pop(chave, None)
+            self._erros.pop(chave, None)
+            timer = self._timers.pop(chave, None)
+        if timer is not None:
+            timer.cancel()
+
+    def flush(self, worksheet=None, username=None):
+        """Grava já o que estiver pendente (de um usuário, ou de todos)."""
+        with self._lock:
+            chaves = [
+                chave for chave in self._pendentes
+                if worksheet is None or chave == (id(worksheet), str(username))
+            ]
+        return all([self._flush_chave(chave) for chave in chaves])
+
+    def _flush_chave(self, chave):
+        with self._lock:
+            pendente = self._pendentes.pop(chave, None)
+            timer = self._timers.pop(chave, None)
+        if timer is not None:
+            timer.cancel()
+        if pendente is None:
+            return True
+        try:
+            _write_checklist(*pendente)
+        except Exception as e:
+            # Mantém o estado para a próxima tentativa, a menos que um clique
+            # mais recente já o tenha substituído (e agendado a sua)
+            with self._lock:
+                if self._pendentes.setdefault(chave, pendente) is pendente:
+                    tentativas = self._erros.get(chave, (None, 0))[1] + 1
+                    self._erros[chave] = (str(e), tentativas)
+                    if chave not in self._timers:
+                        espera = min(CHECKLIST_DEBOUNCE * 2 ** tentativas, CHECKLIST_RETRY_MAX)
+                        self._agendar(chave, espera)
+            return False
+        with self._lock:
+            self._erros.pop(chave, None)
+        return True
+
+
+_checklist_buffer = _ChecklistWriteBehind()
+atexit.register(_checklist_buffer.flush)
+
+
+@_medido
 def get_checklist(worksheet, username):
     try:
-        records = worksheet.get_all_records()
-        if not records:
-            return [], []
-        df = pd.DataFrame(records)
-        if 'username' not in df.columns or 'checklist_tarefas' not in df.columns or 'checklist_status' not in df.columns:
+        pendente = _checklist_buffer.pending(worksheet, username)
+        if pendente is not None:
+            return pendente
+        row = read_user_fields(worksheet, username, ['checklist_tarefas', 'checklist_status'])
+        if row is None:
             return [], []
-        tarefas_str = df.loc[df['username'] == username, 'checklist_tarefas'].values
-        status_str = df.loc[df['username'] == username, 'checklist_status'].values
-        tarefas = tarefas_str[0].split(';') if tarefas_str.size > 0 and tarefas_str[0] else []
-        status = list(map(int, status_str[0].split(';'))) if status_str.size > 0 and status_str[0] else []
-        return tarefas, status
+        return row['checklist_tarefas'], row['checklist_status']
     except Exception as e:
         st.error(f"Erro ao obter checklist: {e}")
         return [], []
 
 
+@_medido
 def set_checklist(worksheet, username, tarefas, status):
     try:
-        records = worksheet.get_all_records()
-        if not records:
-            df = pd.DataFrame(columns=["username", "checklist_tarefas", "checklist_status"])
-        else:
-            df = pd.DataFrame(records)
-
-        if 'username' not in df.columns:
-            df['username'] = ""
-        if 'checklist_tarefas' not in df.columns:
-            df['checklist_tarefas'] = ""
-        if 'checklist_status' not in df.columns:
-            df['checklist_status'] = ""
-
-        tarefas_str = ';'.join(tarefas)
-        status_str = ';'.join(map(str, status))
-        idx = df.index[df['username'] == username].tolist()
-        if not idx:
-            nova_linha = {"username": username, "checklist_tarefas": tarefas_str, "checklist_status": status_str}
-            df = pd.concat([df, pd.DataFrame([nova_linha])], ignore_index=True)
-        else:
-            i = idx[0]
-            df.at[i, "checklist_tarefas"] = tarefas_str
-            df.at[i, "checklist_status"] = status_str
-        df = df.fillna("")
-        worksheet.clear()
-        worksheet.update([df.columns.values.tolist()] + df.values.tolist())
+        _checklist_buffer.discard(worksheet, username)
+        _write_checklist(worksheet, username, tarefas, status)
         return True
     except Exception as e:
         st.error(f"Erro ao salvar checklist: {e}")
         return False
 
 
+def queue_checklist(worksheet, username, tarefas, status):
+    """Agenda a gravação do checklist sem bloquear o clique.
+
+    Cliques seguidos são agrupados numa única escrita; get_checklist já
+    devolve o estado pendente enquanto ele não é gravado.
+    """
+    _checklist_buffer.schedule(worksheet, username, tarefas, status)
+
+
+def has_pending_writes(worksheet, username):
+    return _checklist_buffer.pending(worksheet, username) is not None
+
+
+def pending_write_error(worksheet, username):
+    """Erro da última tentativa de gravar o checklist pendente, ou None."""
+    return _checklist_buffer.error(worksheet, username)
+
+
+@_medido
+def flush_pending_writes(worksheet=None, username=None):
+    try:
+        if _checklist_buffer.flush(worksheet, username):
+            return True
+        st.error("Erro ao salvar checklist: as alterações continuam pendentes.")
+        return False
+    except Exception as e:
+        st.error(f"Erro ao salvar checklist: {e}")
+        return False
+
+
+@_medido
+def add_tarefa(worksheet, username, tarefa):
+    """Acrescenta uma tarefa pendente ao fim do checklist."""
+    try:
+        # A tarefa nova vai depois do estado que ainda está no buffer
+        _checklist_buffer.flush(worksheet, username)
+        _backend(worksheet).append_to_lists(username, {"checklist_tarefas": tarefa, "checklist_status": "0"})
+        return True
+    except Exception as e:
+        st.error(f"Erro ao adicionar tarefa: {e}")
+        return False
+
+
+@_medido
 def get_orcamento(worksheet, username):
     try:
-        records = worksheet.get_all_records()
-        if not records:
-            return 0.0
-        df = pd.DataFrame(records)
-        if 'username' not in df.columns or 'orcamento' not in df.columns:
-            return 0.0
-        orcamento = df.loc[df['username'] == username, 'orcamento'].values
-        return float(orcamento[0]) if orcamento.size > 0 and orcamento[0] else 0.0
+        row = read_user_fields(worksheet, username, ['orcamento'])
+        return row['orcamento'] if row else 0.0
     except Exception as e:
         st.error(f"Erro ao obter orçamento: {e}")
         return 0.0
 
 
+@_medido
 def set_orcamento(worksheet, username, orcamento):
     try:
-        records = worksheet.get_all_records()
-        if not records:
-            df = pd.DataFrame(columns=["username", "orcamento"])
-        else:
-            df = pd.DataFrame(records)
-
-        if 'username' not in df.columns:
-            df['username'] = ""
-        if 'orcamento' not in df.columns:
-            df['orcamento'] = 0.0
-
-        idx = df.index[df['username'] == username].tolist()
-        if not idx:
-            nova_linha = {"username": username, "orcamento": orcamento}
-            df = pd.concat([df, pd.DataFrame([nova_linha])], ignore_index=True)
-        else:
-            i = idx[0]
-            df.at[i, "orcamento"] = orcamento
-        df = df.fillna("")
-        worksheet.clear()
-        worksheet.update([df.columns.values.tolist()] + df.values.tolist())
+        _backend(worksheet).write_fields(username, {"orcamento": orcamento})
         return True
     except Exception as e:
         st.error(f"Erro ao salvar orçamento: {e}")
         return False
 
 
+@_medido
 def get_gastos(worksheet, username):
     try:
-        records = worksheet.get_all_records()
-        if not records:
-            return pd.DataFrame(columns=['descricao', 'valor', 'forma_pagamento'])
-        df = pd.DataFrame(records)
-        if 'username' not in df.columns or 'gastos' not in df.columns:
-            return pd.DataFrame(columns=['descricao', 'valor', 'forma_pagamento'])
-        gastos_str = df.loc[df['username'] == username, 'gastos'].values
-        if gastos_str.size == 0 or not gastos_str[0]:
-            return pd.DataFrame(columns=['descricao', 'valor', 'forma_pagamento'])
-        return pd.read_json(gastos_str[0])
+        return _get_colecao(worksheet, username, 'gastos')
     except Exception as e:
         st.error(f"Erro ao obter gastos: {e}")
-        return pd.DataFrame(columns=['descricao', 'valor', 'forma_pagamento'])
+        return _itens_para_df('gastos', [])
 
 
+@_medido
 def set_gastos(worksheet, username, gastos_df):
     try:
-        records = worksheet.get_all_records()
-        if not records:
-            df = pd.DataFrame(columns=["username", "gastos"])
-        else:
-            df = pd.DataFrame(records)
-
-        if 'username' not in df.columns:
-            df['username'] = ""
-        if 'gastos' not in df.columns:
-            df['gastos'] = ""
-
-        gastos_json = gastos_df.to_json(orient='records')
-        idx = df.index[df['username'] == username].tolist()
-        if not idx:
-            nova_linha = {"username": username, "gastos": gastos_json}
-            df = pd.concat([df, pd.DataFrame([nova_linha])], ignore_index=True)
-        else:
-            i = idx[0]
-            df.at[i, "gastos"] = gastos_json
-        df = df.fillna("")
-        worksheet.clear()
-        worksheet.update([df.columns.values.tolist()] + df.values.tolist())
+        _set_colecao(worksheet, username, 'gastos', gastos_df)
         return True
     except Exception as e:
         st.error(f"Erro ao salvar gastos: {e}")
         return False
 
 
+@_medido
+def add_gasto(worksheet, username, descricao, valor, forma_pagamento):
+    try:
+        _add_item(worksheet, username, 'gastos', {'descricao': descricao, 'valor': valor, 'forma_pagamento': forma_pagamento})
+        return True
+    except Exception as e:
+        st.error(f"Erro ao adicionar gasto: {e}")
+        return False
+
+
+@_medido
 def get_presentes(worksheet, username):
     try:
-        records = worksheet.get_all_records()
-        if not records:
-            return pd.DataFrame(columns=['convidado', 'presente', 'agradecimento_enviado'])
-        df = pd.DataFrame(records)
-        if 'username' not in df.columns or 'presentes' not in df.columns:
-            return pd.DataFrame(columns=['convidado', 'presente', 'agradecimento_enviado'])
-        presentes_str = df.loc[df['username'] == username, 'presentes'].values
-        if presentes_str.size == 0 or not presentes_str[0]:
-            return pd.DataFrame(columns=['convidado', 'presente', 'agradecimento_enviado'])
-        return pd.read_json(presentes_str[0])
+        return _get_colecao(worksheet, username, 'presentes')
     except Exception as e:
         st.error(f"Erro ao obter presentes: {e}")
-        return pd.DataFrame(columns=['convidado', 'presente', 'agradecimento_enviado'])
+        return _itens_para_df('presentes', [])
 
 
+@_medido
 def set_presentes(worksheet, username, presentes_df):
     try:
-        records = worksheet.get_all_records()
-        if not records:
-            df = pd.DataFrame(columns=["username", "presentes"])
-        else:
-            df = pd.DataFrame(records)
-
-        if 'username' not in df.columns:
-            df['username'] = ""
-        if 'presentes' not in df.columns:
-            df['presentes'] = ""
-
-        presentes_json = presentes_df.to_json(orient='records')
-        idx = df.index[df['username'] == username].tolist()
-        if not idx:
-            nova_linha = {"username": username, "presentes": presentes_json}
-            df = pd.concat([df, pd.DataFrame([nova_linha])], ignore_index=True)
-        else:
-            i = idx[0]
-            df.at[i, "presentes"] = presentes_json
-        df = df.fillna("")
-        worksheet.clear()
-        worksheet.update([df.columns.values.tolist()] + df.values.tolist())
+        _set_colecao(worksheet, username, 'presentes', presentes_df)
         return True
     except Exception as e:
         st.error(f"Erro ao salvar presentes: {e}")
         return False
 
 
+@_medido
+def save_collection_changes(worksheet, username, colecao, original_df, editado_df):
+    """Grava só o que mudou entre o DataFrame carregado e o editado.
+
+    Útil com st.data_editor: alterar uma célula grava uma célula, em vez de
+    reescrever a coleção inteira como set_presentes faz.
+    """
+    try:
+        inseridos, alterados, removidos = _diff_colecao(colecao, original_df, editado_df)
+        backend = _backend(worksheet)
+        if alterados:
+            backend.update_items(colecao, username, alterados)
+        if removidos:
+            backend.delete_items(colecao, username, removidos)
+        if inseridos:
+            backend.append_items(colecao, username, inseridos)
+        return True
+    except Exception as e:
+        st.error(f"Erro ao salvar alterações: {e}")
+        return False
+
+
+@_medido
+def add_presente(worksheet, username, convidado, presente, agradecimento_enviado='Não'):
+    try:
+        _add_item(worksheet, username, 'presentes', {'convidado': convidado, 'presente': presente, 'agradecimento_enviado': agradecimento_enviado})
+        return True
+    except Exception as e:
+        st.error(f"Erro ao adicionar presente: {e}")
+        return False
+
+
+@_medido
 def get_sugestoes(worksheet, username):
     try:
-        records = worksheet.get_all_records()
-        if not records:
-            return pd.DataFrame(columns=['item', 'detalhes'])
-        df = pd.DataFrame(records)
-        if 'username' not in df.columns or 'sugestoes' not in df.columns:
-            return pd.DataFrame(columns=['item', 'detalhes'])
-        sugestoes_str = df.loc[df['username'] == username, 'sugestoes'].values
-        if sugestoes_str.size == 0 or not sugestoes_str[0]:
-            return pd.DataFrame(columns=['item', 'detalhes'])
-        return pd.read_json(sugestoes_str[0])
+        return _get_colecao(worksheet, username, 'sugestoes')
     except Exception as e:
         st.error(f"Erro ao obter sugestões: {e}")
-        return pd.DataFrame(columns=['item', 'detalhes'])
+        return _itens_para_df('sugestoes', [])
 
 
+@_medido
 def set_sugestoes(worksheet, username, sugestoes_df):
     try:
-        records = worksheet.get_all_records()
-        if not records:
-            df = pd.DataFrame(columns=["username", "sugestoes"])
-        else:
-            df = pd.DataFrame(records)
-
-        if 'username' not in df.columns:
-            df['username'] = ""
-        if 'sugestoes' not in df.columns:
-            df['sugestoes'] = ""
-
-        sugestoes_json = sugestoes_df.to_json(orient='records')
-        idx = df.index[df['username'] == username].tolist()
-        if not idx:
-            nova_linha = {"username": username, "sugestoes": sugestoes_json}
-            df = pd.concat([df, pd.DataFrame([nova_linha])], ignore_index=True)
-        else:
-            i = idx[0]
-            df.at[i, "sugestoes"] = sugestoes_json
-        df = df.fillna("")
-        worksheet.clear()
-        worksheet.update([df.columns.values.tolist()] + df.values.tolist())
+        _set_colecao(worksheet, username, 'sugestoes', sugestoes_df)
         return True
     except Exception as e:
         st.error(f"Erro ao salvar sugestões: {e}")
         return False
 
 
+@_medido
+def add_sugestao(worksheet, username, item, detalhes=''):
+    try:
+        _add_item(worksheet, username, 'sugestoes', {'item': item, 'detalhes': detalhes})
+        return True
+    except Exception as e:
+        st.error(f"Erro ao adicionar sugestão: {e}")
+        return False
+
+
+@_medido
 def get_brincadeiras(worksheet, username):
     try:
-        records = worksheet.get_all_records()
-        if not records:
-            return pd.DataFrame(columns=['nome', 'regras'])
-        df = pd.DataFrame(records)
-        if 'username' not in df.columns or 'brincadeiras' not in df.columns:
-            return pd.DataFrame(columns=['nome', 'regras'])
-        brincadeiras_str = df.loc[df['username'] == username, 'brincadeiras'].values
-        if brincadeiras_str.size == 0 or not brincadeiras_str[0]:
-            return pd.DataFrame(columns=['nome', 'regras'])
-        return pd.read_json(brincadeiras_str[0])
+        return _get_colecao(worksheet, username, 'brincadeiras')
     except Exception as e:
         st.error(f"Erro ao obter brincadeiras: {e}")
-        return pd.DataFrame(columns=['nome', 'regras'])
+        return _itens_para_df('brincadeiras', [])
 
 
+@_medido
 def set_brincadeiras(worksheet, username, brincadeiras_df):
     try:
-        records = worksheet.get_all_records()
-        if not records:
-            df = pd.DataFrame(columns=["username", "brincadeiras"])
-        else:
-            df = pd.DataFrame(records)
-
-        if 'username' not in df.columns:
-            df['username'] = ""
-        if 'brincadeiras' not in df.columns:
-            df['brincadeiras'] = ""
-
-        brincadeiras_json = brincadeiras_df.to_json(orient='records')
-        idx = df.index[df['username'] == username].tolist()
-        if not idx:
-            nova_linha = {"username": username, "brincadeiras": brincadeiras_json}
-            df = pd.concat([df, pd.DataFrame([nova_linha])], ignore_index=True)
-        else:
-            i = idx[0]
-            df.at[i, "brincadeiras"] = brincadeiras_json
-        df = df.fillna("")
-        worksheet.clear()
-        worksheet.update([df.columns.values.tolist()] + df.values.tolist())
+        _set_colecao(worksheet, username, 'brincadeiras', brincadeiras_df)
         return True
     except Exception as e:
         st.error(f"Erro ao salvar brincadeiras: {e}")
         return False
 
 
+@_medido
+def add_brincadeira(worksheet, username, nome, regras=''):
+    try:
+        _add_item(worksheet, username, 'brincadeiras', {'nome': nome, 'regras': regras})
+        return True
+    except Exception as e:
+        st.error(f"Erro ao adicionar brincadeira: {e}")
+        return False
+
+
+@_medido
+def get_dashboard_summary(worksheet, username):
+    """Tudo o que o Painel Principal mostra, lido numa única chamada à API."""
+    vazio = {"convidados": 0, "tarefas_pendentes": 0, "orcamento": 0.0, "total_gasto": 0.0}
+    try:
+        row, itens = _backend(worksheet).read_bundle(
+            username, ['convidados', 'checklist_status', 'orcamento'], ['gastos'])
+        if row is None:
+            return vazio
+        row = {col: _parse(col, valor) for col, valor in row.items()}
+        gastos_df = _itens_para_df('gastos', itens['gastos'])
+        status = row['checklist_status']
+        return {
+            "convidados": len(row['convidados']),
+            "tarefas_pendentes": len(status) - sum(status),
+            "orcamento": row['orcamento'],
+            "total_gasto": float(gastos_df['valor'].sum()) if not gastos_df.empty else 0.0,
+        }
+    except Exception as e:
+        st.error(f"Erro ao carregar o painel: {e}")
+        return vazio
+
+
+@_medido
 def reset_all_data_for_user(worksheet, username):
     try:
-        records = worksheet.get_all_records()
-        if not records:
-            return True
-        df = pd.DataFrame(records)
-        if 'username' not in df.columns:
+        _checklist_buffer.discard(worksheet, username)
+        backend = _backend(worksheet)
+        if backend.read_fields(username, ['username']) is None:
             return True
-        idx = df.index[df['username'] == username].tolist()
-        if idx:
-            i = idx[0]
-            # Apaga todas as colunas exceto username, email, name, password
-            for col in df.columns:
-                if col not in ['username', 'email', 'name', 'password']:
-                    if df[col].dtype == object:
-                        df.at[i, col] = ""
-                    else:
-                        df.at[i, col] = 0
-            df = df.fillna("")
-            worksheet.clear()
-            worksheet.update([df.columns.values.tolist()] + df.values.tolist())
+        # Apaga todas as colunas exceto username, email, name, password
+        backend.write_fields(username, {
+            col: "" for col in backend.columns() if col not in USER_COLUMNS
+        })
+        for colecao in COLLECTION_COLUMNS:
+            ids = [item['id'] for item in backend.read_items(colecao, username)]
+            if ids:
+                backend.delete_items(colecao, username, ids)
         return True
     except Exception as e:
         st.error(f"Erro ao resetar dados: {e}")
         return False
+
+
+# Partes que load_user_bundle sabe ler: (colunas da aba principal, coleção)
+BUNDLE_PARTS = {
+    'evento': (['nome_bebe', 'sexo_bebe', 'data_cha'], None),
+    'convidados': (['convidados'], None),
+    'checklist': (['checklist_tarefas', 'checklist_status'], None),
+    'orcamento': (['orcamento'], None),
+    'gastos': ([], 'gastos'),
+    'presentes': ([], 'presentes'),
+    'sugestoes': ([], 'sugestoes'),
+    'brincadeiras': ([], 'brincadeiras'),
+}
+
+# Dados de uma página, com os mesmos tipos dos get_* correspondentes:
+# evento (dict), convidados (list), checklist ((tarefas, status)),
+# orcamento (float) e um DataFrame por coleção. Partes não pedidas são None.
+UserBundle = namedtuple('UserBundle', list(BUNDLE_PARTS), defaults=[None] * len(BUNDLE_PARTS))
+
+_prefetch_pool = ThreadPoolExecutor(max_workers=PREFETCH_WORKERS, thread_name_prefix='prefetch')
+
+
+def _na_operacao(op, funcao, *args):
+    # Roda numa thread do pool contando as chamadas na operação de quem pediu
+    _op_local.atual = op
+    try:
+        return funcao(*args)
+    finally:
+        _op_local.atual = None
+
+
+def _preparar_indices(worksheet, colecoes):
+    """Lê em paralelo as abas e os índices que ainda não estão em memória.
+
+    Numa planilha fria, cada coleção precisa achar a aba e ler o índice
+    dela antes da leitura dos dados; em série, essas esperas se somam.
+    Erros são ignorados aqui: a leitura de verdade tenta de novo e os trata.
+    """
+    spreadsheet = worksheet.spreadsheet
+    tarefas = []
+    with _revisoes_lock:
+        revisao = _revisoes.get(spreadsheet.id)
+        if revisao is None:
+            tarefas.append((_geracao, spreadsheet))
+    geracao = revisao['geracao'] if revisao is not None else None
+
+    def em_dia(index):
+        # Índices de outra geração são relidos por _get_index/_get_tab_index
+        return index is not None and revisao is not None and index.geracao == geracao
+
+    with _snapshots_lock:
+        if not em_dia(_indices.get(_snapshot_key(worksheet))):
+            tarefas.append((_get_index, worksheet))
+        for colecao in colecoes:
+            aba = _abas.get((spreadsheet.id, colecao))
+            if aba is None or not em_dia(_tab_indices.get(_snapshot_key(aba))):
+                tarefas.append((lambda c: _get_tab_index(_get_aba(worksheet, c)), colecao))
+    if len(tarefas) < 2:
+        return
+    op = _op_atual()
+    wait([_prefetch_pool.submit(_na_operacao, op, funcao, arg) for funcao, arg in tarefas])
+
+
+@_medido
+def load_user_bundle(worksheet, username, parts=None):
+    """Várias partes dos dados do usuário de uma vez, num UserBundle.
+
+    `parts` é uma lista de nomes de BUNDLE_PARTS (todas, se None). Campos e
+    coleções saem de uma única leitura; antes dela, as abas e índices que
+    faltam são lidos em paralelo, então a página espera pela leitura mais
+    lenta, e não pela soma delas.
+    """
+    parts = list(BUNDLE_PARTS) if parts is None else list(parts)
+    desconhecidas = [parte for parte in parts if parte not in BUNDLE_PARTS]
+    if desconhecidas:
+        raise ValueError(f"Partes desconhecidas: {', '.join(desconhecidas)}")
+    colunas = [col for parte in parts for col in BUNDLE_PARTS[parte][0]]
+    colecoes = [BUNDLE_PARTS[parte][1] for parte in parts if BUNDLE_PARTS[parte][1]]
+    try:
+        if not isinstance(worksheet, StorageBackend):
+            _preparar_indices(worksheet, colecoes)
+        row, itens = _backend(worksheet).read_bundle(username, colunas, colecoes)
+        row = {col: _parse(col, valor) for col, valor in (row or {}).items()}
+    except Exception as e:
+        st.error(f"Erro ao carregar os dados: {e}")
+        row, itens = {}, {}
+
+    valores = {}
+    for parte in parts:
+        if parte == 'evento':
+            valores[parte] = {col: row[col] for col in BUNDLE_PARTS[parte][0]} if row else {}
+        elif parte == 'convidados':
+            valores[parte] = row.get('convidados', [])
+        elif parte == 'checklist':
+            pendente = _checklist_buffer.pending(worksheet, username)
+            valores[parte] = pendente if pendente is not None else (
+                row.get('checklist_tarefas', []), row.get('checklist_status', []))
+        elif parte == 'orcamento':
+            valores[parte] = row.get('orcamento', 0.0)
+        else:
+            valores[parte] = _itens_para_df(parte, itens.get(parte, []))
+    return UserBundle(**valores)
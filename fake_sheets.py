@@ -0,0 +1,248 @@
+"""Planilha em memória que imita a parte do gspread usada pelo database.py.
+
+Serve para medir e exercitar o database.py sem uma conta Google:
+
+    ws = FakeWorksheet([['username', 'email'], ['ana', 'ana@x.com']])
+    database.get_orcamento(ws, 'ana')
+    ws.calls  # Counter com as chamadas feitas à "API"
+    ws.bytes  # Counter com os bytes enviados e recebidos
+
+Para simular a rede, FakeSpreadsheet(latencia=0.2, cota_por_minuto=60)
+faz cada chamada demorar 0,2 s e responder 429 acima de 60 por minuto.
+"""
+import itertools
+import json
+import threading
+import time
+from collections import Counter, deque
+
+from gspread.exceptions import APIError, WorksheetNotFound
+from gspread.utils import a1_range_to_grid_range, a1_to_rowcol
+
+_ids = itertools.count(1)
+
+
+def _tamanho(valor):
+    # Bytes do JSON que iria pela rede
+    return len(json.dumps(valor, default=str, ensure_ascii=False).encode())
+
+
+class _Resposta429:
+    status_code = 429
+    text = "Quota exceeded"
+
+    def json(self):
+        return {'error': {'code': 429, 'message': self.text, 'status': 'RESOURCE_EXHAUSTED'}}
+
+
+class FakeSpreadsheet:
+    def __init__(self, latencia=0.0, cota_por_minuto=None):
+        self.id = f"fake-{next(_ids)}"
+        self.client = None
+        # Contadores únicos para todas as abas, como a cota da API
+        self.calls = Counter()
+        self.bytes = Counter()
+        self.abas = {}
+        # Sobe a cada escrita, como o modifiedTime do Drive
+        self.revisao = 0
+        self.latencia = latencia
+        self.cota_por_minuto = cota_por_minuto
+        self._recentes = deque()
+        self._lock = threading.Lock()
+
+    def _chamada(self, metodo, *enviado):
+        """Conta a chamada e os bytes enviados; aplica latência e cota."""
+        if self.cota_por_minuto is not None:
+            with self._lock:
+                agora = time.monotonic()
+                while self._recentes and agora - self._recentes[0] > 60:
+                    self._recentes.popleft()
+                if len(self._recentes) >= self.cota_por_minuto:
+                    self.calls['429'] += 1
+                    raise APIError(_Resposta429())
+                self._recentes.append(agora)
+        self.calls[metodo] += 1
+        self.bytes['enviados'] += _tamanho(enviado)
+        if self.latencia:
+            time.sleep(self.latencia)
+
+    def _resposta(self, valor):
+        self.bytes['recebidos'] += _tamanho(valor)
+        return valor
+
+    def worksheet(self, title):
+        self._chamada('worksheet', title)
+        if title not in self.abas:
+            raise WorksheetNotFound(title)
+        return self.abas[title]
+
+    def add_worksheet(self, title, rows, cols, index=None):
+        self._chamada('add_worksheet', title, rows, cols)
+        self.revisao += 1
+        return FakeWorksheet(spreadsheet=self, title=title)
+
+    def get_lastUpdateTime(self):
+        self._chamada('get_lastUpdateTime')
+        return self._resposta(f"2024-01-01T00:00:00.{self.revisao:06d}Z")
+
+    def values_batch_get(self, ranges, params=None):
+        self._chamada('values_batch_get', ranges, params)
+        formatado = (params or {}).get('valueRenderOption') != 'UNFORMATTED_VALUE'
+        resposta = []
+        for r in ranges:
+            titulo, intervalo = r.rsplit('!', 1)
+            valores = self.abas[titulo.strip("'").replace("''", "'")]._range(intervalo, formatado)
+            item = {'range': r}
+            if valores:
+                item['values'] = valores
+            resposta.append(item)
+        return self._resposta({'spreadsheetId': self.id, 'valueRanges': resposta})
+
+    def values_batch_update(self, params=None, body=None):
+        self._chamada('values_batch_update', body)
+        # Como na API, confere todos os intervalos antes de gravar: ou grava
+        # tudo ou nada
+        destinos = []
+        for item in body['data']:
+            titulo, intervalo = item['range'].rsplit('!', 1)
+            titulo = titulo.strip("'").replace("''", "'")
+            if titulo not in self.abas:
+                raise WorksheetNotFound(titulo)
+            destinos.append((self.abas[titulo], intervalo, item['values']))
+        for aba, intervalo, valores in destinos:
+            aba._write(intervalo, valores)
+        return {'spreadsheetId': self.id}
+
+    def batch_update(self, body):
+        self._chamada('batch_update', body)
+        self.revisao += 1
+        abas = {aba.id: aba for aba in self.abas.values()}
+        for request in body['requests']:
+            intervalo = request['deleteDimension']['range']
+            del abas[intervalo['sheetId']].rows[intervalo['startIndex']:intervalo['endIndex']]
+        return {}
+
+
+class FakeWorksheet:
+    def __init__(self, valores=None, spreadsheet=None, title='Página1', **kwargs):
+        # kwargs (latencia, cota_por_minuto) vão para a planilha criada aqui
+        self.spreadsheet = spreadsheet or FakeSpreadsheet(**kwargs)
+        self.client = self.spreadsheet.client
+        self.id = next(_ids)
+        self.title = title
+        self.rows = [list(linha) for linha in (valores or [])]
+        self.spreadsheet.abas[title] = self
+
+    @property
+    def calls(self):
+        return self.spreadsheet.calls
+
+    @property
+    def bytes(self):
+        return self.spreadsheet.bytes
+
+    def _chamada(self, metodo, *enviado):
+        self.spreadsheet._chamada(metodo, *enviado)
+
+    def _resposta(self, valor):
+        return self.spreadsheet._resposta(valor)
+
+    # --- leitura ---
+
+    def get_all_values(self, **kwargs):
+        self._chamada('get_all_values')
+        valores = self._range(None, formatado=True)
+        # O gspread completa as linhas até a largura da maior
+        largura = max((len(linha) for linha in valores), default=0)
+        return self._resposta([linha + [""] * (largura - len(linha)) for linha in valores])
+
+    def get_all_records(self, **kwargs):
+        self._chamada('get_all_records')
+        valores = self._range(None, formatado=True)
+        if not valores:
+            return []
+        self._resposta(valores)
+        return [dict(zip(valores[0], linha)) for linha in valores[1:]]
+
+    def get(self, range_name=None, **kwargs):
+        self._chamada('get', range_name)
+        return self._resposta(self._range(range_name, self._formatado(kwargs)))
+
+    def batch_get(self, ranges, **kwargs):
+        self._chamada('batch_get', ranges)
+        formatado = self._formatado(kwargs)
+        return self._resposta([self._range(r, formatado) for r in ranges])
+
+    # --- escrita ---
+
+    def clear(self):
+        self._chamada('clear')
+        self.spreadsheet.revisao += 1
+        self.rows = []
+
+    def update(self, range_name, values=None, **kwargs):
+        # Assim como no gspread 5, aceita update(valores) sem range
+        if values is None:
+            range_name, values = 'A1', range_name
+        self._chamada('update', range_name, values)
+        self._write(range_name, values)
+
+    def batch_update(self, data, **kwargs):
+        self._chamada('batch_update', data)
+        for item in data:
+            self._write(item['range'], item['values'])
+
+    def append_row(self, values, **kwargs):
+        self._chamada('append_row', values)
+        return self._resposta(self._append([values]))
+
+    def append_rows(self, values, **kwargs):
+        self._chamada('append_rows', values)
+        return self._resposta(self._append(values))
+
+    # --- internos ---
+
+    @staticmethod
+    def _formatado(kwargs):
+        return kwargs.get('value_render_option') not in ('UNFORMATTED_VALUE', 'unformatted_value')
+
+    def _append(self, values):
+        self.spreadsheet.revisao += 1
+        while self.rows and not any(v != "" for v in self.rows[-1]):
+            self.rows.pop()
+        primeira = len(self.rows) + 1
+        self.rows.extend(list(linha) for linha in values)
+        return {'updates': {'updatedRange': f"'{self.title}'!A{primeira}:{len(self.rows)}"}}
+
+    def _range(self, range_name, formatado):
+        grade = self.rows
+        if range_name:
+            g = a1_range_to_grid_range(range_name.split('!')[-1])
+            grade = [
+                linha[g.get('startColumnIndex', 0):g.get('endColumnIndex')]
+                for linha in grade[g.get('startRowIndex', 0):g.get('endRowIndex')]
+            ]
+        if formatado:
+            grade = [["" if v is None else str(v) for v in linha] for linha in grade]
+        # Como na API, linhas e colunas vazias no fim não são devolvidas
+        grade = [list(linha) for linha in grade]
+        for linha in grade:
+            while linha and linha[-1] == "":
+                linha.pop()
+        while grade and not grade[-1]:
+            grade.pop()
+        return grade
+
+    def _write(self, range_name, values):
+        self.spreadsheet.revisao += 1
+        linha0, coluna0 = a1_to_rowcol(range_name.split('!')[-1].split(':')[0])
+        for i, valores in enumerate(values):
+            r = linha0 - 1 + i
+            while len(self.rows) <= r:
+                self.rows.append([])
+            for j, valor in enumerate(valores):
+                c = coluna0 - 1 + j
+                linha = self.rows[r]
+                while len(linha) <= c:
+                    linha.append("")
+                linha[c] = valor
@@ -0,0 +1,17 @@
+import database
+
+
+def migrar_colecoes():
+    sheet = database.connect_to_sheet(offline=False)
+    if sheet is None:
+        print("Não foi possível conectar à planilha.")
+        return
+
+    # Gastos, presentes, sugestões e brincadeiras saem das células JSON da
+    # aba principal e vão para as abas próprias, uma linha por item.
+    migradas = database.migrate_json_collections(sheet)
+    print(f"Migração concluída: {migradas} coleção(ões) movida(s) para as abas próprias.")
+
+
+if __name__ == "__main__":
+    migrar_colecoes()
@@ -1,30 +1,72 @@
+"""Converte as senhas em texto puro da planilha para hash bcrypt.
+
+Senhas que já são hash bcrypt ficam como estão, então o script pode ser
+executado de novo a qualquer momento: se for interrompido, a próxima
+execução continua de onde parou. Os hashes são calculados em paralelo em
+todos os núcleos, e só as células de senha alteradas são gravadas, em lotes.
+
+Uso: python migrar_senhas.py [tamanho_do_lote]
+"""
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import bcrypt
+
 import database
-import pandas as pd
-import streamlit_authenticator as stauth
 
-def migrar_senhas():
-    sheet = database.connect_to_sheet()
+# Usuários convertidos e gravados por vez; é o máximo que se perde (e
+# precisa ser refeito) se a migração for interrompida no meio
+LOTE = 200
+
+_BCRYPT = re.compile(r'^\$2[aby]\$\d{2}\$[./A-Za-z0-9]{53}$')
+
+
+def ja_tem_hash(senha):
+    return bool(_BCRYPT.match(str(senha)))
+
+
+def gerar_hash(senha):
+    # Mesmo formato do stauth.Hasher
+    return bcrypt.hashpw(str(senha).encode(), bcrypt.gensalt()).decode()
+
+
+def migrar_senhas(lote=LOTE):
+    sheet = database.connect_to_sheet(offline=False)
     users_df = database.fetch_all_users(sheet)
     if users_df.empty:
         print("Nenhum usuário encontrado na planilha.")
         return
 
-    # Senhas atuais em texto puro
-    senhas = users_df['password'].tolist()
+    pendentes = [
+        (str(u), str(s)) for u, s in zip(users_df['username'], users_df['password'])
+        if u and s != "" and not ja_tem_hash(s)
+    ]
+    print(f"{len(users_df)} usuários, {len(users_df) - len(pendentes)} já com hash, "
+          f"{len(pendentes)} para converter.")
+    if not pendentes:
+        return
 
-    # Gerar hashes das senhas
-    hasher = stauth.Hasher(senhas)
-    senhas_hash = hasher.generate()
+    inicio = time.monotonic()
+    feitos = 0
+    with ProcessPoolExecutor(max_workers=os.cpu_count()) as pool:
+        for i in range(0, len(pendentes), lote):
+            usernames, senhas = zip(*pendentes[i:i + lote])
+            hashes = pool.map(gerar_hash, senhas, chunksize=max(1, len(senhas) // (4 * (os.cpu_count() or 1))))
+            valores = {u: {'password': h} for u, h in zip(usernames, hashes)}
+            if not database.update_user_fields(sheet, valores):
+                print(f"Erro ao gravar o lote {i // lote + 1}; rode o script de novo para continuar.")
+                return
+            feitos += len(valores)
+            decorrido = time.monotonic() - inicio
+            restante = decorrido / feitos * (len(pendentes) - feitos)
+            print(f"[{feitos:>{len(str(len(pendentes)))}}/{len(pendentes)}] senhas convertidas "
+                  f"({decorrido:.0f}s, ~{restante:.0f}s restantes)")
 
-    # Atualiza o DataFrame com as senhas hasheadas
-    users_df['password'] = senhas_hash
+    print("Migração concluída: senhas convertidas para hash e atualizadas na planilha.")
 
-    # Atualiza a planilha
-    sucesso = database.update_users(sheet, users_df)
-    if sucesso:
-        print("Migração concluída: senhas convertidas para hash e atualizadas na planilha.")
-    else:
-        print("Erro ao atualizar a planilha.")
 
 if __name__ == "__main__":
-    migrar_senhas()
+    migrar_senhas(int(sys.argv[1]) if len(sys.argv) > 1 else LOTE)
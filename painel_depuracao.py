@@ -0,0 +1,38 @@
+"""Painel com as chamadas ao banco feitas no rerun atual, na barra lateral.
+
+Fica escondido; aparece com ?debug=1 na URL ou com debug_panel = true em
+[database] nos secrets:
+
+    database.start_rerun_metrics()    # no começo do rerun
+    ...
+    painel_depuracao.mostrar()        # no fim (num finally)
+"""
+import pandas as pd
+import streamlit as st
+
+import database
+
+COLUNAS = [
+    'op', 'chamadas_api', 'cache', 'linhas_lidas', 'linhas_escritas',
+    'bytes_lidos', 'bytes_escritos', 'latencia_ms',
+]
+
+
+def ativo():
+    if st.query_params.get("debug") == "1":
+        return True
+    try:
+        return bool(st.secrets.get("database", {}).get("debug_panel", False))
+    except Exception:
+        return False
+
+
+def mostrar():
+    if not ativo():
+        return
+    operacoes = database.get_rerun_metrics()
+    with st.sidebar.expander("🛠️ Depuração: este rerun"):
+        st.caption(f"{len(operacoes)} operações, {sum(op['chamadas_api'] for op in operacoes)} chamadas à API, "
+                   f"{sum(op['latencia_ms'] for op in operacoes):.0f} ms no banco")
+        if operacoes:
+            st.dataframe(pd.DataFrame(operacoes)[COLUNAS], hide_index=True)
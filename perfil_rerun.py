@@ -0,0 +1,141 @@
+"""Perfil (cProfile) de um rerun inteiro do app, para achar o que deixa uma página lenta.
+
+Liga com ?profile=1 na URL ou com profile = true em [database] nos secrets:
+
+    perfil = perfil_rerun.iniciar()       # logo depois do st.set_page_config
+    try:
+        ...                               # o script inteiro
+    finally:
+        perfil_rerun.finalizar(perfil)    # mostra o relatório
+
+O finally garante que o perfil é desligado também quando o rerun termina
+com st.rerun(), st.stop() ou um erro.
+
+O relatório separa o tempo em I/O do gspread, pandas, Streamlit e
+database.py, lista as funções com maior tempo acumulado e oferece o .prof
+para abrir no snakeviz ou no pstats. Só a thread do rerun é medida; as
+leituras em segundo plano do database.py ficam de fora.
+"""
+import cProfile
+import io
+import marshal
+import os
+import pstats
+import time
+
+import pandas as pd
+import streamlit as st
+
+# Funções mostradas na lista por tempo acumulado
+TOP_FUNCOES = 25
+
+# Pacotes (ou módulos da biblioteca padrão) de cada categoria de tempo
+_CATEGORIAS = [
+    ('I/O do gspread', {'gspread', 'requests', 'urllib3', 'google', 'httplib2', 'socket.py', 'ssl.py', 'http'}),
+    ('pandas', {'pandas', 'numpy', 'pyarrow'}),
+    ('Streamlit', {'streamlit', 'streamlit_authenticator'}),
+]
+
+
+def ativo():
+    if st.query_params.get("profile") == "1":
+        return True
+    try:
+        return bool(st.secrets.get("database", {}).get("profile", False))
+    except Exception:
+        return False
+
+
+def iniciar():
+    """Começa a medir o rerun; devolve None se o perfil está desligado."""
+    if not ativo():
+        return None
+    perfil = cProfile.Profile()
+    try:
+        perfil.enable()
+    except ValueError:
+        # Outra sessão já está sendo medida (só um perfil por vez a partir do Python 3.12)
+        st.sidebar.info("⏱️ Perfil indisponível: outra sessão está sendo medida.")
+        return None
+    perfil.inicio = time.perf_counter()
+    return perfil
+
+
+def _categoria(arquivo):
+    if arquivo == '~':
+        return None  # função embutida: decidida por quem a chamou
+    partes = arquivo.replace('\\', '/').split('/')
+    if 'site-packages' in partes:
+        pacote = partes[partes.index('site-packages') + 1]
+    elif len(partes) >= 2:
+        # Biblioteca padrão: o pacote (http/...) ou o módulo (ssl.py)
+        pacote = partes[-2] if partes[-2] == 'http' else partes[-1]
+    else:
+        pacote = partes[-1]
+    for nome, pacotes in _CATEGORIAS:
+        if pacote in pacotes:
+            return nome
+    if partes[-1] == 'database.py':
+        return 'database.py'
+    return 'app e outros'
+
+
+def tempo_por_categoria(estatisticas):
+    """Tempo próprio (sem subchamadas) somado por categoria, em segundos.
+
+    O tempo de funções embutidas (leitura de socket, sleep, ...) vai para a
+    categoria de quem as chamou, na proporção de cada chamador.
+    """
+    tempos = {}
+    for (arquivo, _, nome), (_, _, proprio, _, chamadores) in estatisticas.stats.items():
+        categoria = _categoria(arquivo)
+        if categoria is None and 'time.sleep' in nome:
+            categoria = 'esperas (sleep)'
+        if categoria is not None:
+            tempos[categoria] = tempos.get(categoria, 0.0) + proprio
+            continue
+        total_chamadores = sum(c[2] for c in chamadores.values())
+        for chamador, (_, _, parcial, _) in chamadores.items():
+            categoria = _categoria(chamador[0]) or 'app e outros'
+            fracao = parcial / total_chamadores if total_chamadores else 1 / len(chamadores)
+            tempos[categoria] = tempos.get(categoria, 0.0) + proprio * fracao
+        if not chamadores:
+            tempos['app e outros'] = tempos.get('app e outros', 0.0) + proprio
+    return tempos
+
+
+def finalizar(perfil):
+    """Para de medir e mostra o relatório na barra lateral."""
+    if perfil is None:
+        return
+    perfil.disable()
+    decorrido = time.perf_counter() - perfil.inicio
+    estatisticas = pstats.Stats(perfil)
+    # Antes do strip_dirs, que encurta os caminhos usados nas categorias
+    arquivo_prof = marshal.dumps(estatisticas.stats)
+
+    tempos = tempo_por_categoria(estatisticas)
+    total = sum(tempos.values()) or 1.0
+    resumo = pd.DataFrame(
+        [(categoria, segundos * 1000, 100 * segundos / total) for categoria, segundos in
+         sorted(tempos.items(), key=lambda item: -item[1])],
+        columns=['categoria', 'ms', '%'],
+    )
+
+    texto = io.StringIO()
+    estatisticas.stream = texto
+    estatisticas.strip_dirs().sort_stats('cumulative').print_stats(TOP_FUNCOES)
+
+    with st.sidebar.expander("⏱️ Perfil deste rerun", expanded=True):
+        st.caption(f"{decorrido * 1000:.0f} ms no total")
+        st.dataframe(resumo, hide_index=True, column_config={
+            'ms': st.column_config.NumberColumn(format="%.0f"),
+            '%': st.column_config.NumberColumn(format="%.0f%%"),
+        })
+        st.caption("Funções por tempo acumulado")
+        st.code(texto.getvalue(), language=None)
+        st.download_button(
+            "Baixar .prof", arquivo_prof,
+            file_name=f"rerun_{time.strftime('%Y%m%d_%H%M%S')}_{os.getpid()}.prof",
+            mime="application/octet-stream", on_click="ignore",
+        )
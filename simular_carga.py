@@ -0,0 +1,264 @@
+"""Teste de carga: várias sessões simultâneas usando o app ao mesmo tempo.
+
+Cada sessão é uma thread (como no servidor do Streamlit) que repete fluxos
+de uso do app, escolhidos ao acaso: login, painel, adicionar convidado,
+marcar tarefa do checklist e editar presentes. Cada fluxo faz as mesmas
+chamadas ao database.py que os reruns das páginas correspondentes.
+
+Ao final, para cada quantidade de sessões, imprime por fluxo: execuções,
+latência p50/p95/p99, vazão, erros, esperas no limitador local e
+respostas 429 da API.
+
+Backends:
+  fake    planilha em memória do fake_sheets.py, com latência e cota
+          configuráveis (padrão)
+  sqlite  banco SQLite local num arquivo temporário
+
+Uso: python simular_carga.py [--sessoes 1 10 50] [--duracao 30]
+                             [--backend fake|sqlite] [--usuarios 1000]
+                             [--latencia 0.1] [--cota 300] [--pausa 0.5]
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+
+import pandas as pd
+import streamlit as st
+
+import benchmark_database
+import database
+
+# Peso de cada fluxo: login e painel são as telas mais vistas
+PESOS = {
+    'login': 2,
+    'painel': 4,
+    'add_convidado': 2,
+    'checklist': 2,
+    'editar_presentes': 1,
+}
+
+
+# --- fluxos: cada um recebe (ws, username) e devolve se deu certo ---
+
+def login(ws, username):
+    credenciais = database.get_user_credentials(ws, username)
+    database.get_evento_atual(ws, username)
+    return credenciais is not None
+
+
+def painel(ws, username):
+    database.get_evento_atual(ws, username)
+    database.get_dashboard_summary(ws, username)
+    return True
+
+
+def add_convidado(ws, username):
+    database.get_evento_atual(ws, username)
+    database.get_convidados(ws, username)
+    ok = database.add_convidado(ws, username, f"Convidado {random.randint(1, 10**6)}")
+    # O rerun depois do clique relê a lista
+    database.get_convidados(ws, username)
+    return ok
+
+
+def checklist(ws, username):
+    database.get_evento_atual(ws, username)
+    tarefas, status = database.get_checklist(ws, username)
+    if status:
+        i = random.randrange(len(status))
+        status[i] = 0 if status[i] else 1
+        database.queue_checklist(ws, username, tarefas, status)
+    database.get_checklist(ws, username)
+    # Ao trocar de página o app grava o que estiver pendente
+    return database.flush_pending_writes(ws, username)
+
+
+def editar_presentes(ws, username):
+    database.get_evento_atual(ws, username)
+    original = database.get_presentes(ws, username)
+    editado = original.copy()
+    if not editado.empty:
+        linha = editado.index[random.randrange(len(editado))]
+        atual = editado.loc[linha, 'agradecimento_enviado']
+        editado.loc[linha, 'agradecimento_enviado'] = 'Não' if atual == 'Sim' else 'Sim'
+    ok = database.save_collection_changes(ws, username, 'presentes', original, editado)
+    database.get_presentes(ws, username)
+    return ok
+
+
+FLUXOS = {
+    'login': login,
+    'painel': painel,
+    'add_convidado': add_convidado,
+    'checklist': checklist,
+    'editar_presentes': editar_presentes,
+}
+
+
+# --- backends ---
+
+def backend_fake(n_usuarios, latencia, cota):
+    return benchmark_database.montar_planilha(n_usuarios, latencia=latencia, cota_por_minuto=cota)
+
+
+def backend_sqlite(n_usuarios, latencia, cota):
+    caminho = os.path.join(tempfile.mkdtemp(), 'carga.db')
+    backend = database.SQLiteBackend(caminho)
+    modelo = benchmark_database.montar_planilha(n_usuarios)
+    backend.replace_users(pd.DataFrame(modelo.rows[1:], columns=modelo.rows[0]))
+    for colecao, colunas in database.COLLECTION_COLUMNS.items():
+        por_usuario = defaultdict(list)
+        for linha in modelo.spreadsheet.abas[colecao].rows[1:]:
+            por_usuario[linha[0]].append(dict(zip(['id'] + colunas, linha[1:])))
+        for username, itens in por_usuario.items():
+            backend.append_items(colecao, username, itens)
+    return backend
+
+
+BACKENDS = {'fake': backend_fake, 'sqlite': backend_sqlite}
+
+
+# --- coleta ---
+
+class Coleta:
+    """Latências e contadores por fluxo, de todas as sessões."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.latencias = defaultdict(list)
+        self.contadores = defaultdict(Counter)
+
+    @property
+    def fluxo_atual(self):
+        return getattr(self._local, 'fluxo', None)
+
+    def contar(self, chave, n=1):
+        if chave == 'st.error':
+            self._local.erro = True
+        fluxo = self.fluxo_atual
+        if fluxo is not None:
+            with self._lock:
+                self.contadores[fluxo][chave] += n
+
+    def executar(self, nome, ws, username):
+        self._local.fluxo = nome
+        self._local.erro = False
+        inicio = time.perf_counter()
+        try:
+            # Erros de leitura só aparecem como st.error; o get_* devolve o padrão
+            ok = FLUXOS[nome](ws, username) and not self._local.erro
+        except Exception:
+            ok = False
+        finally:
+            decorrido = time.perf_counter() - inicio
+            self._local.fluxo = None
+        with self._lock:
+            self.latencias[nome].append(decorrido)
+            if not ok:
+                self.contadores[nome]['erros'] += 1
+
+
+# Coleta da rodada em andamento (ver _instrumentar)
+_coleta = None
+
+
+def _instrumentar():
+    """Atribui ao fluxo da thread os contadores do database.py e os st.error."""
+    conta_original = database._conta
+
+    def conta(chave, n=1):
+        conta_original(chave, n)
+        if _coleta is not None:
+            _coleta.contar(chave, n)
+
+    def erro(*args, **kwargs):
+        if _coleta is not None:
+            _coleta.contar('st.error')
+
+    database._conta = conta
+    st.error = erro
+
+
+def _sessao(coleta, ws, username, fim, pausa, semente):
+    aleatorio = random.Random(semente)
+    nomes, pesos = list(PESOS), list(PESOS.values())
+    while time.monotonic() < fim:
+        coleta.executar(aleatorio.choices(nomes, pesos)[0], ws, username)
+        if pausa:
+            time.sleep(aleatorio.uniform(0, 2 * pausa))
+
+
+def _percentil(valores, p):
+    if len(valores) == 1:
+        return valores[0]
+    return statistics.quantiles(valores, n=100, method='inclusive')[p - 1]
+
+
+def rodar(ws, n_sessoes, duracao, pausa, n_usuarios):
+    global _coleta
+    coleta = _coleta = Coleta()
+    fim = time.monotonic() + duracao
+    threads = [
+        threading.Thread(
+            target=_sessao,
+            args=(coleta, ws, f'user{i * 7919 % n_usuarios}', fim, pausa, i),
+            daemon=True,
+        )
+        for i in range(n_sessoes)
+    ]
+    inicio = time.monotonic()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return coleta, time.monotonic() - inicio
+
+
+def imprimir(coleta, decorrido, n_sessoes):
+    print(f"\n{n_sessoes} sessões, {decorrido:.1f}s")
+    print(f"{'fluxo':<18} {'execuções':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+          f"{'por s':>7} {'erros':>6} {'esperas':>8} {'429':>5}")
+    # esperas: média, por execução, de chamadas seguradas pelo limitador local
+    for nome in FLUXOS:
+        latencias = coleta.latencias.get(nome)
+        if not latencias:
+            continue
+        c = coleta.contadores[nome]
+        n = len(latencias)
+        print(f"{nome:<18} {n:>9} "
+              f"{_percentil(latencias, 50) * 1000:>8.0f} {_percentil(latencias, 95) * 1000:>8.0f} "
+              f"{_percentil(latencias, 99) * 1000:>8.0f} {n / decorrido:>7.1f} "
+              f"{c['erros'] / n:>6.1%} {c['throttled'] / n:>8.2f} {c['rate_limited']:>5}")
+    total = sum(len(v) for v in coleta.latencias.values())
+    print(f"{'total':<18} {total:>9} {'':>26} {total / decorrido:>7.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sessoes', type=int, nargs='+', default=[1, 10, 50])
+    parser.add_argument('--duracao', type=float, default=30, help="segundos por rodada")
+    parser.add_argument('--backend', choices=sorted(BACKENDS), default='fake')
+    parser.add_argument('--usuarios', type=int, default=1000, help="usuários na planilha")
+    parser.add_argument('--latencia', type=float, default=0.1, help="segundos por chamada (só fake)")
+    parser.add_argument('--cota', type=int, default=None, help="chamadas por minuto antes do 429 (só fake)")
+    parser.add_argument('--pausa', type=float, default=0.5, help="tempo médio entre fluxos de uma sessão")
+    args = parser.parse_args()
+
+    _instrumentar()
+    for n_sessoes in args.sessoes:
+        # Cada rodada começa do zero: dados, caches e limitador
+        ws = BACKENDS[args.backend](args.usuarios, args.latencia, args.cota)
+        database._bucket = database._TokenBucket(database._quota_por_minuto())
+        database._disjuntor = database._Disjuntor()
+        coleta, decorrido = rodar(ws, n_sessoes, args.duracao, args.pausa, args.usuarios)
+        imprimir(coleta, decorrido, n_sessoes)
+
+
+if __name__ == '__main__':
+    main()